@@ -2,11 +2,15 @@ from rest_framework.viewsets import ModelViewSet
 from rest_framework.response import Response
 from rest_framework import status
 from .auth_serializers import CustomerRegSerializer
+from .custom_classes import KeysetPagination
 from .models import CustomUser
 
 class ModifyUserView(ModelViewSet):
     serializer_class = CustomerRegSerializer
     lookup_field = 'id'
+    # Only paginates when asked with ?pagination=cursor, otherwise the full list as before.
+    pagination_class = KeysetPagination
+    keyset_ordering_fields = ['email']
 
     def get_queryset(self):
         query_set = CustomUser.objects.all() 
@@ -16,6 +20,10 @@ class ModifyUserView(ModelViewSet):
         user = request.user
         if not user.is_superuser:
             return Response({'error': 'You do not have permission to perform this action.'}, status=status.HTTP_403_FORBIDDEN)
+        page = self.paginate_queryset(self.get_queryset())
+        if page is not None:
+            serializer = self.serializer_class(page, many=True)
+            return self.get_paginated_response(serializer.data)
         serializer = self.serializer_class(self.get_queryset(), many=True)
         return Response(serializer.data, status=status.HTTP_200_OK)
     
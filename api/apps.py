@@ -4,3 +4,17 @@ from django.apps import AppConfig
 class ApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'api'
+
+    def ready(self):
+        from . import signals  # noqa: F401
+
+        # Lets SimpleJWT tokens rotate keys through the same registry as the email tokens.
+        from rest_framework_simplejwt import state
+        from rest_framework_simplejwt.settings import api_settings
+        from .custom_classes import KeyRegistryTokenBackend
+
+        state.token_backend = KeyRegistryTokenBackend(
+            api_settings.ALGORITHM, api_settings.SIGNING_KEY, api_settings.VERIFYING_KEY,
+            api_settings.AUDIENCE, api_settings.ISSUER, api_settings.JWK_URL,
+            api_settings.LEEWAY, api_settings.JSON_ENCODER,
+        )
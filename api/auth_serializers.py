@@ -1,13 +1,15 @@
 from rest_framework import serializers
 from rest_framework_simplejwt import serializers as JWT_SERIALIZER
+from rest_framework_simplejwt.settings import api_settings as JWT_SETTINGS
 from django.core.validators import MinLengthValidator
-from django.contrib.auth import authenticate
 
 from phonenumber_field.serializerfields import PhoneNumberField
 
 from django.utils import timezone
 from datetime import datetime
 from .models import CustomUser
+from .utils.token import black_list_user_tokens
+from .utils.last_login import record_last_login
 import email_validator, os
 
 class CustomerRegSerializer(serializers.Serializer):
@@ -149,22 +151,24 @@ class LoginSerializer(JWT_SERIALIZER.TokenObtainPairSerializer):
     password = serializers.CharField(write_only=True, style={'input_type': 'password'})
         
     def validate(self, attrs):
-        data = super().validate(attrs)
+        # One lookup, one password hash and one token pair per login.
         email = attrs['email'].lower()
         try:
             valid_email = email_validator.validate_email(email, check_deliverability=False)
-            email = CustomUser.objects.get(email=valid_email.normalized, is_active=True)
-        except CustomUser.DoesNotExist:
+            user = CustomUser.objects.get(email=valid_email.normalized, is_active=True)
+        except (CustomUser.DoesNotExist, email_validator.EmailNotValidError):
             raise serializers.ValidationError('Email does not exist.')
-        user = authenticate(email=email, password=attrs['password'])
-        if not user:
+        if not user.check_password(attrs['password']):
             raise serializers.ValidationError({"error": "Could not log in with the provided credentials"})
         if not user.email_verified:
             raise serializers.ValidationError({"error": "Email has not been verified"})
-        if not user.is_active:
-            raise serializers.ValidationError({"error": "User's account has been deactivated."})
         self.user = user
-        data.update({'user': self.user})
+        # Revoke the previous sessions before issuing, so the new refresh token stays valid.
+        black_list_user_tokens(user)
+        refresh = self.get_token(user)
+        data = {'refresh': str(refresh), 'access': str(refresh.access_token), 'user': user}
+        if JWT_SETTINGS.UPDATE_LAST_LOGIN:
+            record_last_login(user)
         return data
 
 class ResetPasswordSerializer(serializers.Serializer):
@@ -6,7 +6,6 @@ from rest_framework.decorators import (
                                         permission_classes, renderer_classes
                                     )
 from rest_framework.renderers import TemplateHTMLRenderer, JSONRenderer
-from rest_framework_simplejwt.tokens import AccessToken
 from rest_framework_simplejwt.views import TokenRefreshView
 from django.contrib.auth.hashers import check_password
 from django.db import transaction
@@ -20,16 +19,16 @@ from .auth_serializers import (
                                 SetPasswordSerializer, ChangePasswordSerializer, CustomerProfileSerializer
                             )
 from .utils.token import (
-                            encode_token, decode_token, 
+                            encode_token, decode_token, consume_email_token, 
                             black_list_user_tokens, 
-                            valid_access_token
+                            valid_access_token, blacklist_access_token
                         )
 from .utils.helper_functions import (
                             check_email_id_exist_in_token, 
                             set_user_password_reset_time,
                             retrieve_user_profile
                         )
-from .models import CustomUser, BlaskListAccessToken
+from .models import CustomUser
 from api.tasks import send_email
 import os
 
@@ -43,7 +42,7 @@ class CustomerRegView(APIView):
         serializer = self.serializer_class(data=request.data)
         serializer.is_valid(raise_exception=True)
         user = serializer.save()
-        token = encode_token(user.id, user.email)
+        token = encode_token(user.id, user.email, purpose="register")
         verification_link = f"{os.environ.get('APP_DOMAIN')}/verify_email/register?token={token}"
          # Task will only be queued if the transaction commits successfully
         transaction.on_commit(
@@ -68,7 +67,7 @@ class VendorRegView(APIView):
         serializer = self.serializer_class(data=request.data)
         serializer.is_valid(raise_exception=True)
         user = serializer.save()
-        token = encode_token(user.id, user.email)
+        token = encode_token(user.id, user.email, purpose="register")
         verification_link = f"{os.environ.get('APP_DOMAIN')}/verify_email/register?token={token}"
         transaction.on_commit(
             lambda: send_email.delay(
@@ -101,7 +100,7 @@ def verifyRegEmail(request):
     if token is None:
         return Response({"error": "Token is missing."}, 
                         template_name="api/invalid_token.html", status=400)
-    payload = decode_token(token)
+    payload = decode_token(token, purpose="register")
     if not payload:
         return Response({"error": "Invalid Token."}, 
                         template_name="api/invalid_token.html", status=400)
@@ -113,6 +112,9 @@ def verifyRegEmail(request):
     if not user:
         return Response({"error": "Invalid Token"}, 
                         template_name="api/invalid_token.html", status=400)
+    if not consume_email_token(payload):
+        return Response({"error": "Invalid Token"}, 
+                        template_name="api/invalid_token.html", status=400)
     user.email_verified = True
     user.save(update_fields=["email_verified"])
     return Response({"success": "Email verified successfully."}, 
@@ -128,7 +130,6 @@ class LoginView(APIView):
         serializer = self.serializer_class(data=request.data)
         serializer.is_valid(raise_exception=True)
         data = serializer.validated_data
-        black_list_user_tokens(user=data["user"])    
         return Response(
                         {'access': data['access'],
                          'refresh': data['refresh']
@@ -145,7 +146,7 @@ class ResetPasswordView(APIView):
         serializer = self.serializer_class(data=request.data)
         serializer.is_valid(raise_exception=True)
         user = serializer.validated_data["email"]
-        token = encode_token(user.id, user.email)
+        token = encode_token(user.id, user.email, purpose="password_reset")
         verification_link = f"{os.environ.get('APP_DOMAIN')}/verify/password_reset?token={token}"
         send_email.delay(
             subject="Verify your email",
@@ -175,7 +176,7 @@ def verifyPasswordResetEmail(request):
     if token is None:
         return Response({"error": "Token is missing"}, 
                         template_name="api/invalid_token.html", status=400)
-    payload = decode_token(token)
+    payload = decode_token(token, purpose="password_reset")
     if not payload:
         return Response({"error": "Invalid Token"}, 
                         template_name="api/invalid_token.html", status=400)
@@ -187,6 +188,12 @@ def verifyPasswordResetEmail(request):
     if not user:
         return Response({"error": "Invalid Token"}, 
                         template_name="api/invalid_token.html", status=400)
+    if not user.email_verified:
+        return Response({"error": "Invalid Token"}, 
+                        template_name="api/invalid_token.html", status=400)
+    if not consume_email_token(payload):
+        return Response({"error": "Invalid Token"}, 
+                        template_name="api/invalid_token.html", status=400)
     can_reset = set_user_password_reset_time(user)
     if not can_reset:
         return Response({"error": "Invalid Token"}, 
@@ -243,9 +250,10 @@ class LogoutView(APIView):
     def post(self, request, *args, **kwargs):
         try:
             # Invalidates the current access token to avoid re-validation before expiration time is up.
-            token = AccessToken(request.auth) 
+            # request.auth is the AccessToken already validated by the authentication class.
+            token = request.auth
             jti = token['jti']
-            BlaskListAccessToken.objects.create(jti=jti)
+            blacklist_access_token(jti, token['exp'])
         except Exception:
             return Response({'error': 'Invalid Token'}, status=400)
         
@@ -261,23 +269,23 @@ class CustomerProfileView(ModelViewSet):
         return self.request.user
     
     def retrieve(self, request, *args, **kwargs):
-        if not valid_access_token(request):
+        if not valid_access_token(request.auth):
             return Response({"error": "Inavid token."}, status=400)
         user = retrieve_user_profile(request.user)
         serializer = self.serializer_class(user)
         return Response(serializer.data, status=200)
     
     def update(self, request, *args, **kwargs):
-        if not valid_access_token(request):
+        if not valid_access_token(request.auth):
             return Response({"error": "Inavid token."}, status=400)
         serializer = self.serializer_class(data=request.data, instance=self.get_object(),
                                         partial=True)
         serializer.is_valid(raise_exception=True)
         user = serializer.save()
         if user.pending_email:
-            token = encode_token(user.id, user.pending_email)
+            token = encode_token(user.id, user.pending_email, purpose="email_update")
             verification_link = f"{os.environ.get('APP_DOMAIN')}/verify/email_update?token={token}"
-            token = encode_token(user.id, user.pending_email)
+            token = encode_token(user.id, user.pending_email, purpose="email_update")
             send_email.delay(
                     subject="Update your email", txt_template="api/text_mails/update_email.txt",
                     html_template="api/update_email.html", 
@@ -288,10 +296,10 @@ class CustomerProfileView(ModelViewSet):
         return Response({"success": "Profile updated successfully."}, status=200)
     
     def destroy(self, request, *args, **kwargs):
-        if not valid_access_token(request):
+        if not valid_access_token(request.auth):
             return Response({"error": "Inavid token."}, status=400)
         user = request.user
-        token = encode_token(user.id, user.email)
+        token = encode_token(user.id, user.email, purpose="deactivate")
         verification_link = f"{os.environ.get('APP_DOMAIN')}/verify/acct_deactivation?token={token}"   
         send_email.delay(
                 subject="Deactivate your account?", txt_template="api/text_mails/deactivate_acct_alert.txt",
@@ -310,23 +318,23 @@ class VendorProfileView(ModelViewSet):
         return self.request.user
     
     def retrieve(self, request, *args, **kwargs):
-        if not valid_access_token(request):
+        if not valid_access_token(request.auth):
             return Response({"error": "Inavid token."}, status=400)
         user = retrieve_user_profile(request.user)
         serializer = self.serializer_class(user)
         return Response(serializer.data, status=200)
     
     def update(self, request, *args, **kwargs):
-        if not valid_access_token(request):
+        if not valid_access_token(request.auth):
             return Response({"error": "Inavid token."}, status=400)
         serializer = self.serializer_class(data=request.data, instance=self.get_object(), 
                                            partial=True)
         serializer.is_valid(raise_exception=True)
         user = serializer.save()
         if user.pending_email:
-            token = encode_token(user.id, user.email)
+            token = encode_token(user.id, user.email, purpose="email_update")
             verification_link = f"{os.environ.get('APP_DOMAIN')}/verify_email_update?token={token}"
-            token = encode_token(user.id, user.pending_email)
+            token = encode_token(user.id, user.pending_email, purpose="email_update")
             send_email.delay(
                     subject="Update your email", txt_template="api/text_mails/update_email.txt",
                     html_template="api/update_email.html", 
@@ -339,10 +347,10 @@ class VendorProfileView(ModelViewSet):
         return Response({"success": "Profile updated successfully."}, status=200)
     
     def destroy(self, request, *args, **kwargs):
-        if not valid_access_token(request):
+        if not valid_access_token(request.auth):
             return Response({"error": "Inavid token."}, status=400)
         user = request.user
-        token = encode_token(user.id, user.email)
+        token = encode_token(user.id, user.email, purpose="deactivate")
         verification_link = f"{os.environ.get('APP_DOMAIN')}/verify/acct_deactivation?token={token}"   
         send_email.delay(
                 subject="Deactivate your account?", txt_template="api/text_mails/deactivate_acct_alert.txt", html_template="api/deactivate_acct_alert.html", 
@@ -370,7 +378,7 @@ def verifyEmailUpdate(request):
     token = request.query_params.get("token") or request.GET.get("token")
     if token is None:
         return Response({"error": "Token is missing."}, status=400)
-    payload = decode_token(token)
+    payload = decode_token(token, purpose="email_update")
     if not payload:
         return Response({"error": "Inavlid token"}, status=400)
     pending_email = payload.get("sub")
@@ -390,6 +398,9 @@ def verifyEmailUpdate(request):
     if not user:
         return Response({"error": "Invalid token"},
                         template_name="api/invalid_token.html", status=400)
+    if not consume_email_token(payload):
+        return Response({"error": "Invalid Token"}, 
+                        template_name="api/invalid_token.html", status=400)
     user.email, user.pending_email = pending_email, None
     user.save(update_fields=["email", "pending_email"])
     return Response({"success": "Email updated successfully."},
@@ -413,7 +424,7 @@ def verifyAcctDeactivation(request):
     if token is None:
         return Response({"error": "Token is missing."}, status=400,
                             template_name="api/invalid_token.html")
-    payload = decode_token(token)
+    payload = decode_token(token, purpose="deactivate")
     if not payload:
         return Response({"error": "Invalid token"}, status=400, template_name="api/invalid_token.html")
     email = payload.get("sub")
@@ -425,6 +436,8 @@ def verifyAcctDeactivation(request):
         return Response({"error": "Invalid token"}, status=400, template_name="api/invalid_token.html")
     if not user.email_verified:
         return Response({"error": "Invalid token"}, status=400, template_name="api/invalid_token.html")
+    if not consume_email_token(payload):
+        return Response({"error": "Invalid token"}, status=400, template_name="api/invalid_token.html")
     user.is_active = False
     user.save(update_fields=["is_active"])
     return Response({"success": "Account has been deactivated successfully"}, status=200, template_name="api/deactivate_acct_verified.html")
@@ -27,4 +27,14 @@ def updateImage(public_id):
         )
     except Exception as e:
         return False
-    return response
\ No newline at end of file
+    return response
+
+def imageMetadata(response):
+    # Fields stored on Product so product reads are served without calling Cloudinary.
+    return {
+        "srcURL": response.get("secure_url", ""),
+        "image_width": response.get("width"),
+        "image_height": response.get("height"),
+        "image_format": response.get("format", ""),
+        "image_version": response.get("version"),
+    }
\ No newline at end of file
@@ -1,7 +1,330 @@
-from rest_framework.pagination import PageNumberPagination
+from rest_framework.pagination import PageNumberPagination, BasePagination
+from rest_framework.filters import SearchFilter, OrderingFilter
+from rest_framework.exceptions import NotFound
+from rest_framework.throttling import BaseThrottle
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param, remove_query_param
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.core.paginator import Paginator, PageNotAnInteger, EmptyPage
+from django.db import connection
+from django.db.models import F, Q
+from django.utils.functional import cached_property
+from rest_framework_simplejwt.backends import TokenBackend
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken, AuthenticationFailed
+from rest_framework_simplejwt.settings import api_settings
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured, ValidationError
+from django_filters.rest_framework import FilterSet, NumberFilter
+from .utils.signing_keys import key_registry, is_asymmetric
+from .utils.rate_limit import get_limiter, get_rate_limits
+from .models import auth_user_cache_key, Product
+import jwt, os, json, base64, hashlib, logging
+
+logger = logging.getLogger(__name__)
+
+class KeysetPagination(BasePagination):
+    """
+    Opt-in cursor pagination (?pagination=cursor, then follow next/previous).
+    Pages are fetched with WHERE (field, id) > (last seen) on a stable ordering
+    taken from the view's keyset_ordering_fields, so there is no OFFSET and no
+    COUNT and a deep page costs the same as the first one.
+    """
+    page_size = 2
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    mode_query_param = 'pagination'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def is_requested(self, request):
+        return (self.cursor_query_param in request.query_params
+                or request.query_params.get(self.mode_query_param) == 'cursor')
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(max(size, 1), self.max_page_size)
+
+    def get_ordering(self, request, view):
+        allowed = getattr(view, 'keyset_ordering_fields', ['pk'])
+        requested = request.query_params.get(OrderingFilter.ordering_param, '').split(',')[0].strip()
+        field = requested if requested.lstrip('-') in allowed else allowed[0]
+        descending = field.startswith('-')
+        # id breaks ties, which is what makes the ordering stable across pages.
+        return [(field.lstrip('-'), descending), ('pk', descending)]
+
+    def encode_cursor(self, values, reverse):
+        raw = json.dumps({'v': [str(value) for value in values], 'r': reverse})
+        return base64.urlsafe_b64encode(raw.encode()).decode()
+
+    def decode_cursor(self, request, model):
+        cursor = request.query_params.get(self.cursor_query_param)
+        if not cursor:
+            return None, False
+        try:
+            data = json.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+            values, reverse = data['v'], bool(data['r'])
+        except (ValueError, KeyError, TypeError):
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(values, list) or len(values) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+        # The cursor comes from the client, a value the column cannot hold is a bad cursor
+        # rather than a database error.
+        fields = [model._meta.pk if field == 'pk' else model._meta.get_field(field) for field, _ in self.ordering]
+        try:
+            values = [field.to_python(value) for field, value in zip(fields, values)]
+        except (ValidationError, TypeError):
+            raise NotFound(self.invalid_cursor_message)
+        return values, reverse
+
+    def after(self, ordering, values):
+        condition = Q()
+        for index, (field, descending) in enumerate(ordering):
+            step = Q(**{f"{field}__{'lt' if descending else 'gt'}": values[index]})
+            for position in range(index):
+                step &= Q(**{ordering[position][0]: values[position]})
+            condition |= step
+        # Implied by the OR chain, spelled out so the planner can range scan the
+        # (field, id) index instead of evaluating the OR on every row.
+        field, descending = ordering[0]
+        return Q(**{f"{field}__{'lte' if descending else 'gte'}": values[0]}) & condition
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if not self.is_requested(request):
+            return None
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.ordering = self.get_ordering(request, view)
+        values, reverse = self.decode_cursor(request, queryset.model)
+
+        # Walking backwards is the same query with every direction flipped.
+        ordering = [(field, descending != reverse) for field, descending in self.ordering]
+        queryset = queryset.order_by(*[f"{'-' if descending else ''}{field}" for field, descending in ordering])
+        if values is not None:
+            queryset = queryset.filter(self.after(ordering, values))
+        rows = list(queryset[:self.page_size + 1])
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if reverse:
+            rows.reverse()
+        self.has_next = values is not None if reverse else has_more
+        self.has_previous = has_more if reverse else values is not None
+        self.page = rows
+        return rows
+
+    def row_values(self, row):
+        return [getattr(row, field) for field, _ in self.ordering]
+
+    def get_link(self, row, reverse):
+        url = self.request.build_absolute_uri()
+        url = remove_query_param(url, self.mode_query_param)
+        return replace_query_param(url, self.cursor_query_param,
+                                   self.encode_cursor(self.row_values(row), reverse))
+
+    def get_paginated_response(self, data):
+        next_link = self.get_link(self.page[-1], False) if self.page and self.has_next else None
+        previous_link = self.get_link(self.page[0], True) if self.page and self.has_previous else None
+        return Response({'next': next_link, 'previous': previous_link, 'results': data})
+
+class ApproximateCountPaginator(Paginator):
+    """
+    Counts exactly up to APPROX_COUNT_THRESHOLD rows (a bounded COUNT over a LIMIT
+    subquery). Past that the total comes from the Postgres planner's row estimate,
+    cached for APPROX_COUNT_TIMEOUT seconds, and count_is_approximate is set.
+    """
+    threshold = int(os.environ.get("APPROX_COUNT_THRESHOLD", 10000))
+    cache_timeout = int(os.environ.get("APPROX_COUNT_TIMEOUT", 300))
+    count_is_approximate = False
+
+    def planner_estimate(self):
+        sql, params = self.object_list.order_by().query.sql_with_params()
+        key = f"approx_count_{hashlib.md5(f'{sql}{params}'.encode()).hexdigest()}"
+        estimate = cache.get(key)
+        if estimate is None:
+            with connection.cursor() as cursor:
+                cursor.execute(f"EXPLAIN (FORMAT JSON) {sql}", params)
+                plan = cursor.fetchone()[0]
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            estimate = int(plan[0]["Plan"]["Plan Rows"])
+            cache.set(key, estimate, self.cache_timeout)
+        return estimate
+
+    @cached_property
+    def count(self):
+        if not hasattr(self.object_list, "query") or connection.vendor != "postgresql":
+            return super().count
+        exact = self.object_list.order_by()[:self.threshold + 1].count()
+        if exact <= self.threshold:
+            return exact
+        self.count_is_approximate = True
+        # The planner can underestimate, never report fewer rows than we already counted.
+        return max(self.planner_estimate(), exact)
+
+    def validate_number(self, number):
+        self.count  # decides whether the total is exact
+        if not self.count_is_approximate:
+            return super().validate_number(number)
+        # Pages past an estimated total may still exist, only reject what is invalid outright.
+        try:
+            number = int(number)
+        except (TypeError, ValueError):
+            raise PageNotAnInteger(self.error_messages["invalid_page"])
+        if number < 1:
+            raise EmptyPage(self.error_messages["min_page"])
+        return number
+
+    def page(self, number):
+        number = self.validate_number(number)
+        if not self.count_is_approximate:
+            return super().page(number)
+        # With an estimated total, do not clamp the slice to it.
+        bottom = (number - 1) * self.per_page
+        return self._get_page(self.object_list[bottom:bottom + self.per_page], number, self)
 
 class CustomPageNumberPagination(PageNumberPagination):
         page_size = 2
         page_size_query_param = 'page_size'
         max_page_size = 100
-        
\ No newline at end of file
+        django_paginator_class = ApproximateCountPaginator
+
+        # Page numbers stay the default, ?pagination=cursor switches to keyset pages.
+        def paginate_queryset(self, queryset, request, view=None):
+            self.keyset = KeysetPagination()
+            if self.keyset.is_requested(request):
+                return self.keyset.paginate_queryset(queryset, request, view)
+            self.keyset = None
+            return super().paginate_queryset(queryset, request, view)
+
+        def get_paginated_response(self, data):
+            if self.keyset is not None:
+                return self.keyset.get_paginated_response(data)
+            response = super().get_paginated_response(data)
+            response.data['count_is_approximate'] = self.page.paginator.count_is_approximate
+            return response
+
+class ProductFilter(FilterSet):
+    # Range filters on the price customers pay, served by the effective_price index.
+    min_price = NumberFilter(field_name="effective_price", lookup_expr="gte")
+    max_price = NumberFilter(field_name="effective_price", lookup_expr="lte")
+
+    class Meta:
+        model = Product
+        fields = ["category"]
+
+class ProductSearchFilter(SearchFilter):
+    """
+    Full-text search over Product.search_vector (GIN indexed) on Postgres, ranked by
+    relevance unless the client asked for an explicit ordering. Other databases and
+    price-only searches keep DRF's icontains search over search_fields.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        terms = self.get_search_terms(request)
+        if not terms or connection.vendor != "postgresql":
+            return super().filter_queryset(request, queryset, view)
+        if all(term.replace(".", "", 1).isdigit() for term in terms):
+            return super().filter_queryset(request, queryset, view)
+
+        query = SearchQuery(" ".join(terms), search_type="websearch", config="english")
+        queryset = queryset.filter(search_vector=query).annotate(
+            rank=SearchRank(F("search_vector"), query)
+        )
+        if request.query_params.get(OrderingFilter.ordering_param):
+            return queryset
+        return queryset.order_by("-rank", "id")
+
+class KeyRegistryTokenBackend(TokenBackend):
+    """SimpleJWT backend that signs with the registry's active key and adds a kid header."""
+
+    def encode(self, payload):
+        jwt_payload = payload.copy()
+        if self.audience is not None:
+            jwt_payload["aud"] = self.audience
+        if self.issuer is not None:
+            jwt_payload["iss"] = self.issuer
+
+        kid, key = key_registry.signing_key(self.algorithm)
+        if key is None:
+            if is_asymmetric(self.algorithm):
+                raise ImproperlyConfigured(f"No private key for signing key id {kid!r}.")
+            return super().encode(payload)
+        token = jwt.encode(jwt_payload, key, algorithm=self.algorithm,
+                           headers={"kid": kid}, json_encoder=self.json_encoder)
+        if isinstance(token, bytes):
+            return token.decode("utf-8")
+        return token
+
+    def get_verifying_key(self, token):
+        if self.algorithm.startswith("HS") or self.jwks_client:
+            return super().get_verifying_key(token)
+        try:
+            kid = jwt.get_unverified_header(token).get("kid")
+        except jwt.PyJWTError:
+            kid = None
+        key = key_registry.verifying_key(self.algorithm, kid)
+        if key is None:
+            return super().get_verifying_key(token)
+        return key
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """Resolves the token's user from a cached snapshot, CustomUser.save drops the snapshot."""
+
+    cache_timeout = int(os.environ.get("AUTH_USER_CACHE_TIMEOUT", 300))
+    # Never part of the snapshot, views that need it (password change) load it on access.
+    deferred_fields = ["password"]
+
+    def get_user(self, validated_token):
+        if getattr(api_settings, "CHECK_REVOKE_TOKEN", False):
+            return super().get_user(validated_token)
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken("Token contained no recognizable user identification")
+
+        key = auth_user_cache_key(user_id)
+        user = cache.get(key)
+        if user is None:
+            try:
+                user = self.user_model.objects.defer(*self.deferred_fields).get(
+                    **{api_settings.USER_ID_FIELD: user_id}
+                )
+            except self.user_model.DoesNotExist:
+                raise AuthenticationFailed("User not found", code="user_not_found")
+            cache.set(key, user, self.cache_timeout)
+        if not user.is_active:
+            raise AuthenticationFailed("User is inactive", code="user_inactive")
+        return user
+
+class UserRateThrottle(BaseThrottle):
+    """
+    Per-user limit from settings.RATE_LIMITS["user"]. DRF runs throttles after
+    authentication, so the user comes from the token the view already verified.
+    """
+
+    rate = None
+    limiter = None
+
+    def __init__(self):
+        # DRF builds a throttle per request, the limiter (and its local tier) is shared.
+        if UserRateThrottle.limiter is None:
+            limits = get_rate_limits()
+            UserRateThrottle.rate = limits.get("user")
+            UserRateThrottle.limiter = get_limiter(limits)
+
+    def allow_request(self, request, view):
+        user = request.user
+        if not self.rate or not user or not user.is_authenticated:
+            return True
+        try:
+            return self.limiter.hit(f"rt_user_{user.pk}", self.rate["limit"], self.rate["window"])
+        except Exception:
+            # A throttling outage should not take the API down with it.
+            logger.exception("Rate limiter unavailable")
+            return True
+
+    def wait(self):
+        return self.rate["window"] if self.rate else None
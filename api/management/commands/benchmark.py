@@ -0,0 +1,186 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.conf import settings
+from django.test import Client, RequestFactory, override_settings
+from django.http import HttpResponse
+from django.db import connection, transaction
+from django.core.cache import cache
+from rest_framework.filters import SearchFilter
+from rest_framework.request import Request
+from rest_framework_simplejwt.tokens import RefreshToken
+from api.models import CustomUser, BlaskListAccessToken, Category, Product
+from api.utils.token import valid_access_token, sync_blacklist_cache, BLACKLIST_SYNCED_KEY
+from api.utils.middleware import IPTrackingMiddleware
+from api.custom_classes import UserRateThrottle, ProductSearchFilter
+from api.views import ProductView
+import itertools, time, statistics
+
+# Runs in-process against the configured database and cache, so the numbers are
+# for comparing before/after on the same machine, not for capacity planning.
+# Rate limits are lifted for every target but middleware, which is the one measuring them.
+UNLIMITED = {"default": {"limit": 10 ** 9, "window": 1}, "routes": {}, "user": None}
+
+def timed(function, runs):
+    durations = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        function()
+        durations.append(time.perf_counter() - started)
+    return durations
+
+def summary(label, durations):
+    total = sum(durations)
+    return (f"{label}: {len(durations)} runs, {len(durations) / total:.1f}/s, "
+            f"median {statistics.median(durations) * 1000:.2f} ms, "
+            f"p95 {sorted(durations)[int(len(durations) * 0.95) - 1] * 1000:.2f} ms")
+
+class Command(BaseCommand):
+    help = "Measures request throughput of the catalog, auth and rate limiting hot paths."
+
+    def add_arguments(self, parser):
+        parser.add_argument("target", choices=["product_list", "middleware", "login", "search"])
+        parser.add_argument("--requests", type=int, default=200)
+        parser.add_argument("--email", help="User to send requests as, defaults to the first active user.")
+        parser.add_argument("--password", help="Password of --email, required by the login target.")
+        parser.add_argument("--search", default="shirt", help="Search terms used by the search target.")
+        parser.add_argument("--query", default="", help="Query string appended to the URL.")
+        parser.add_argument("--seed", type=int, default=0,
+                            help="Products to create for the search target, rolled back afterwards.")
+
+    def handle(self, *args, **options):
+        self.runs = options["requests"]
+        self.client = Client(SERVER_NAME=self.server_name())
+        bench = getattr(self, f"bench_{options['target']}")
+        if options["target"] == "middleware":
+            return bench(options)
+        # The throttle keeps its limits for the process, reset it on both sides of the override.
+        UserRateThrottle.limiter = None
+        try:
+            with override_settings(RATE_LIMITS={**settings.RATE_LIMITS, **UNLIMITED}):
+                bench(options)
+        finally:
+            UserRateThrottle.limiter = None
+
+    def server_name(self):
+        hosts = [host for host in settings.ALLOWED_HOSTS if host and host != "*"]
+        return hosts[0].lstrip(".") if hosts else "testserver"
+
+    def get_user(self, options):
+        users = CustomUser.objects.filter(is_active=True)
+        user = users.filter(email=options["email"]).first() if options["email"] else users.first()
+        if user is None:
+            raise CommandError("No active user to authenticate as, pass --email.")
+        return user
+
+    def get(self, path, token=None):
+        headers = {"HTTP_AUTHORIZATION": f"Bearer {token}"} if token else {}
+        response = self.client.get(path, secure=not settings.DEBUG, **headers)
+        if response.status_code >= 400:
+            raise CommandError(f"GET {path} failed with {response.status_code}: {response.content[:200]}")
+        return response
+
+    def bench_product_list(self, options):
+        access = RefreshToken.for_user(self.get_user(options)).access_token
+        path = f"/api/v1/product/?{options['query']}"
+        # A unique parameter per request, so the response cache never answers for the view.
+        requests = itertools.count()
+        list_page = lambda: self.get(f"{path}&bench={next(requests)}", str(access))
+
+        # Before: without the synced mirror every request asks the database about its jti.
+        cache.delete(BLACKLIST_SYNCED_KEY)
+        self.stdout.write(summary("GET /product/, blacklist checked in the database (before)",
+                                  timed(list_page, self.runs)))
+        # After: the mirror the beat task keeps synced answers from the cache.
+        if sync_blacklist_cache() is None:
+            raise CommandError("A blacklist cache sync is already running, try again.")
+        self.stdout.write(summary("GET /product/, blacklist checked in the cache (after)",
+                                  timed(list_page, self.runs)))
+
+        # The revocation check on its own: the cached lookup against the query it replaced.
+        self.stdout.write(summary("valid_access_token (cache)", timed(
+            lambda: valid_access_token(access), self.runs)))
+        self.stdout.write(summary("BlaskListAccessToken exists() (previous check)", timed(
+            lambda: BlaskListAccessToken.objects.filter(jti=access["jti"]).exists(), self.runs)))
+
+    def bench_middleware(self, options):
+        user = self.get_user(options)
+        factory = RequestFactory()
+        empty = lambda request: HttpResponse()
+        middleware = IPTrackingMiddleware(empty)
+        # A different client address per request, so the per-IP limit never trips.
+        addresses = (f"10.{n // 65536 % 256}.{n // 256 % 256}.{n % 256}" for n in range(1, self.runs * 3 + 1))
+
+        def request():
+            request = factory.get("/api/v1/product/", REMOTE_ADDR=next(addresses))
+            request.user = user
+            return request
+
+        self.stdout.write(summary("bare view", timed(lambda: empty(request()), self.runs)))
+        self.stdout.write(summary("IPTrackingMiddleware", timed(lambda: middleware(request()), self.runs)))
+        throttle = UserRateThrottle()
+        self.stdout.write(summary("UserRateThrottle.allow_request", timed(
+            lambda: throttle.allow_request(request(), None), self.runs)))
+
+    def bench_login(self, options):
+        if not options["email"] or not options["password"]:
+            raise CommandError("The login target needs --email and --password.")
+        user = self.get_user(options)
+        data = {"email": options["email"], "password": options["password"]}
+
+        def login():
+            response = self.client.post("/api/v1/login/", data, secure=not settings.DEBUG)
+            if response.status_code != 200:
+                raise CommandError(f"Login failed with {response.status_code}: {response.content[:200]}")
+
+        self.stdout.write(summary("POST /login/", timed(login, self.runs)))
+        # The password hash sets the floor, everything above it is queries and token signing.
+        self.stdout.write(summary("check_password", timed(
+            lambda: user.check_password(options["password"]), self.runs)))
+
+    def seed_products(self, options):
+        # One in ten matches the search terms, so the filters have rows to rank and skip.
+        vendor, run = self.get_user(options), time.time_ns()
+        category = Category.objects.create(name=f"Benchmark {run}")
+        products = []
+        for n in range(options["seed"]):
+            name = f"{options['search']} {n}" if n % 10 == 0 else f"Item {n}"
+            product = Product(vendor=vendor, category=category, name=name, stock=1,
+                              description=f"Seeded product {n} for the search benchmark.",
+                              original_price=10 + n % 90, discount_percent=n % 3 * 10,
+                              slug=f"benchmark-{run}-{n}")
+            product.normalize()
+            products.append(product)
+        Product.objects.bulk_create(products, batch_size=1000)
+        if connection.vendor == "postgresql":
+            # Fresh statistics, or the planner still sizes the table as it was before seeding.
+            with connection.cursor() as cursor:
+                cursor.execute(f"ANALYZE {Product._meta.db_table}")
+
+    def bench_search(self, options):
+        with transaction.atomic():
+            if options["seed"]:
+                self.seed_products(options)
+            try:
+                self.search(options)
+            finally:
+                # Seeded rows never outlive the run.
+                transaction.set_rollback(True)
+
+    def search(self, options):
+        request = Request(RequestFactory().get("/api/v1/product/", {"search": options["search"]}))
+        view = ProductView(request=request, format_kwarg=None)
+        queryset = view.get_queryset()
+
+        def first_page(search_filter):
+            return lambda: list(search_filter.filter_queryset(request, queryset, view)[:20])
+
+        if connection.vendor != "postgresql":
+            self.stderr.write("Not on Postgres, the full-text filter falls back to icontains.")
+        # Timings over a handful of rows say nothing about the index, so report the sizes with them.
+        total = queryset.count()
+        for label, search_filter in [("full-text", ProductSearchFilter()), ("icontains", SearchFilter())]:
+            matched = search_filter.filter_queryset(request, queryset, view).count()
+            if not matched:
+                raise CommandError(f"No product matches {options['search']!r} out of {total}, "
+                                   "pass --seed to create some.")
+            self.stdout.write(summary(f"{label} search {options['search']!r}, {matched} of {total} rows",
+                                      timed(first_page(search_filter), self.runs)))
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-18 10:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0022_rename_transaction_id_payment_reference'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='blasklistaccesstoken',
+            name='expires_at',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+    ]
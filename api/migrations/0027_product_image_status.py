@@ -0,0 +1,24 @@
+# Generated by Django 5.2.4 on 2026-10-18 14:10
+
+from django.db import migrations, models
+
+
+def mark_uploaded_images_ready(apps, schema_editor):
+    Product = apps.get_model('api', 'Product')
+    Product.objects.exclude(public_id='').update(image_status='ready')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0026_product_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='image_status',
+            field=models.CharField(choices=[('none', 'None'), ('pending', 'Pending'), ('ready', 'Ready'), ('failed', 'Failed')], default='none', max_length=10),
+        ),
+        migrations.RunPython(mark_uploaded_images_ready, migrations.RunPython.noop),
+    ]
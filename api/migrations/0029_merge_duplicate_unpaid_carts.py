@@ -0,0 +1,42 @@
+# Generated by Django 5.2.4 on 2026-10-18 15:20
+
+from django.db import migrations, models
+
+
+def merge_duplicate_unpaid_carts(apps, schema_editor):
+    # Customers with several unpaid carts keep the most recent one, with the items of the others.
+    Cart = apps.get_model('api', 'Cart')
+    CartItem = apps.get_model('api', 'CartItem')
+    Payment = apps.get_model('api', 'Payment')
+    customers = list(
+        Cart.objects.filter(status='unpaid', customer__isnull=False)
+        .values('customer').annotate(carts=models.Count('id')).filter(carts__gt=1)
+        .values_list('customer', flat=True)
+    )
+    for customer in customers:
+        kept, *duplicates = Cart.objects.filter(customer=customer, status='unpaid').order_by('-updated_at')
+        for item in CartItem.objects.filter(cart__in=duplicates):
+            existing = CartItem.objects.filter(cart=kept, product=item.product_id).first()
+            if existing is None:
+                item.cart = kept
+                item.save(update_fields=['cart'])
+                continue
+            existing.item_quantity += item.item_quantity
+            existing.total_amount += item.total_amount
+            existing.save(update_fields=['item_quantity', 'total_amount'])
+            Payment.objects.filter(cart=item).update(cart=existing)
+            item.delete()
+        Cart.objects.filter(id__in=[cart.id for cart in duplicates]).delete()
+
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0028_product_image_hash'),
+    ]
+
+    # Kept apart from the index migration, Postgres refuses ALTER TABLE with pending trigger events.
+    operations = [
+        migrations.RunPython(merge_duplicate_unpaid_carts, migrations.RunPython.noop),
+    ]
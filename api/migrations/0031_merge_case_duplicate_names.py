@@ -0,0 +1,51 @@
+# Generated by Django 5.2.4 on 2026-10-18 15:45
+
+from django.db import migrations, models
+from django.db.models.functions import Lower
+
+
+def merge(model, kept, duplicates, Product):
+    if model == 'Category':
+        Product.objects.filter(category__in=duplicates).update(category=kept)
+        return
+    # Products tagged with both spellings keep a single row for the kept color.
+    Through = Product.color.through
+    tagged = set(Through.objects.filter(color=kept).values_list('product_id', flat=True))
+    for link in Through.objects.filter(color__in=duplicates):
+        if link.product_id in tagged:
+            link.delete()
+            continue
+        link.color_id = kept.id
+        link.save(update_fields=['color'])
+        tagged.add(link.product_id)
+
+
+def merge_case_duplicate_names(apps, schema_editor):
+    # Names differing only in case point their products at the oldest row and are deleted,
+    # the unique index on Lower(name) in the next migration cannot be built over them.
+    Product = apps.get_model('api', 'Product')
+    for model in ['Category', 'Color']:
+        Model = apps.get_model('api', model)
+        names = list(
+            Model.objects.annotate(lower_name=Lower('name')).values('lower_name')
+            .annotate(rows=models.Count('id')).filter(rows__gt=1).values_list('lower_name', flat=True)
+        )
+        for name in names:
+            rows = Model.objects.annotate(lower_name=Lower('name')).filter(lower_name=name)
+            # A hidden category should not win over a visible spelling of the same name.
+            ordering = ['-is_active', 'date'] if model == 'Category' else ['date']
+            kept, *duplicates = rows.order_by(*ordering, 'id')
+            merge(model, kept, duplicates, Product)
+            Model.objects.filter(id__in=[row.id for row in duplicates]).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0030_cart_catalog_indexes'),
+    ]
+
+    # Kept apart from the constraint migration, Postgres refuses ALTER TABLE with pending trigger events.
+    operations = [
+        migrations.RunPython(merge_case_duplicate_names, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.4 on 2026-10-18 15:50
+
+import django.db.models.functions.text
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0031_merge_case_duplicate_names'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='category',
+            name='name',
+            field=models.CharField(max_length=200),
+        ),
+        migrations.AlterField(
+            model_name='color',
+            name='name',
+            field=models.CharField(max_length=200),
+        ),
+        migrations.AddConstraint(
+            model_name='category',
+            constraint=models.UniqueConstraint(django.db.models.functions.text.Lower('name'), name='category_name_lower_unique'),
+        ),
+        migrations.AddConstraint(
+            model_name='color',
+            constraint=models.UniqueConstraint(django.db.models.functions.text.Lower('name'), name='color_name_lower_unique'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.4 on 2026-10-18 16:30
+
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+
+
+def fill_effective_price(apps, schema_editor):
+    # Same expression as ProductQuerySet.update, a NULL discount counts as none.
+    Product = apps.get_model('api', 'Product')
+    Product.objects.update(effective_price=models.ExpressionWrapper(
+        models.F('original_price') * (100 - Coalesce(models.F('discount_percent'), 0)) / 100,
+        output_field=models.DecimalField(max_digits=10, decimal_places=2),
+    ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0032_name_lower_unique'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='effective_price',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True),
+        ),
+        migrations.RunPython(fill_effective_price, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['effective_price', 'id'], name='product_eff_price_id_idx'),
+        ),
+    ]
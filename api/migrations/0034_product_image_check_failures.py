@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-18 21:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0033_product_effective_price'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='image_check_failures',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
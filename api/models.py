@@ -1,10 +1,87 @@
-from django.db import models
+from django.db import models, transaction, IntegrityError
+from django.db.models import Q, F, Max, Case, When, Value, ExpressionWrapper
+from django.db.models.functions import Cast, Substr, Lower, Coalesce
+from django.core.cache import cache
 from django.utils.text import slugify
 from django.contrib.auth.models import AbstractUser, BaseUserManager
 from django.core.validators import MinValueValidator, MaxValueValidator
+from django.contrib.postgres.search import SearchVectorField
+from django.contrib.postgres.indexes import GinIndex
 from phonenumber_field.modelfields import PhoneNumberField
 
-import uuid, os
+import uuid, os, re
+
+SLUG_RETRIES = 3
+
+# name__lower=value compiles to LOWER(name) = value, which the functional unique indexes below serve.
+models.CharField.register_lookup(Lower)
+
+def auth_user_cache_key(user_id):
+    return f"auth_user_{user_id}"
+
+def next_free_slug(model, name, exclude_pk=None):
+    # One indexed query for the highest numeric suffix already taken on this base.
+    base = slugify(name)[:40] or model._meta.model_name
+    queryset = model.objects.filter(
+        Q(slug=base) | Q(slug__startswith=f"{base}-", slug__regex=rf"^{re.escape(base)}-[0-9]+$")
+    )
+    if exclude_pk is not None:
+        queryset = queryset.exclude(pk=exclude_pk)
+    top = queryset.aggregate(top=Max(Case(
+        When(slug=base, then=Value(0)),
+        default=Cast(Substr("slug", len(base) + 2), models.BigIntegerField()),
+        output_field=models.BigIntegerField(),
+    )))["top"]
+    if top is None:
+        return base
+    return f"{base}-{top + 1}"
+
+def allocate_slugs(model, names):
+    # next_free_slug for a whole batch: one query covering every base, then suffixes handed out in order.
+    bases = [slugify(name)[:40] or model._meta.model_name for name in names]
+    unique_bases = set(bases)
+    if not unique_bases:
+        return []
+    taken, ordered = set(), sorted(unique_bases)
+    # Chunked so a bulk create of thousands of names does not build one enormous OR.
+    for start in range(0, len(ordered), 500):
+        condition = Q()
+        for base in ordered[start:start + 500]:
+            condition |= Q(slug=base) | Q(slug__startswith=f"{base}-")
+        taken.update(model.objects.filter(condition).values_list("slug", flat=True))
+    top = {}
+    for slug in taken:
+        if slug in unique_bases:
+            top[slug] = max(top.get(slug, -1), 0)
+        head, _, suffix = slug.rpartition("-")
+        if head in unique_bases and suffix.isdigit():
+            top[head] = max(top.get(head, -1), int(suffix))
+    slugs = []
+    for base in bases:
+        counter = top.get(base, -1) + 1
+        slug = base if counter == 0 else f"{base}-{counter}"
+        # Another base in the batch can end up on the same slug, e.g. "x" twice and "x 1".
+        while slug in taken:
+            counter += 1
+            slug = f"{base}-{counter}"
+        top[base] = counter
+        taken.add(slug)
+        slugs.append(slug)
+    return slugs
+
+def save_with_slug(instance, save, *args, **kwargs):
+    # Two writers can pick the same suffix, the unique constraint decides and the loser retries.
+    if instance.slug:
+        return save(*args, **kwargs)
+    for attempt in range(SLUG_RETRIES):
+        instance.slug = next_free_slug(type(instance), instance.name, instance.pk)
+        try:
+            with transaction.atomic(using=kwargs.get("using")):
+                return save(*args, **kwargs)
+        except IntegrityError:
+            taken = type(instance).objects.filter(slug=instance.slug).exclude(pk=instance.pk).exists()
+            if not taken or attempt == SLUG_RETRIES - 1:
+                raise
 
 class CustomManager(BaseUserManager):
     def create_user(self, first_name, last_name, email, phone_number, address, business_address, business_name,  password=None, **extra_kwargs):
@@ -73,36 +150,69 @@ class CustomUser(AbstractUser):
         if self.business_name:
             self.business_name = self.business_name.capitalize().strip()
         super().save(*args, **kwargs)
+        # Drop the snapshot used by CachedJWTAuthentication, again after commit so a
+        # request racing this transaction cannot put the old row back.
+        key = auth_user_cache_key(self.id)
+        cache.delete(key)
+        transaction.on_commit(lambda: cache.delete(key), using=kwargs.get("using"))
+
+def effective_price_expression(original_price=F("original_price"), discount_percent=F("discount_percent")):
+    # SQL version of the price Product.normalize stores, for updates that skip save().
+    # A NULL discount counts as no discount, like it does in normalize().
+    price_field = models.DecimalField(max_digits=10, decimal_places=2)
+    if not hasattr(original_price, "resolve_expression"):
+        original_price = Value(original_price, output_field=price_field)
+    if not hasattr(discount_percent, "resolve_expression"):
+        discount_percent = Value(discount_percent, output_field=models.IntegerField())
+    return ExpressionWrapper(original_price * (100 - Coalesce(discount_percent, 0)) / 100,
+                             output_field=price_field)
+
+class ProductQuerySet(models.QuerySet):
+
+    def update(self, **kwargs):
+        # bulk_update() ends up here too, so every bulk price change refreshes effective_price.
+        # Key presence rather than the value, an explicit discount_percent=None clears the discount.
+        if ("original_price" in kwargs or "discount_percent" in kwargs) and "effective_price" not in kwargs:
+            prices = {field: kwargs[field] for field in ("original_price", "discount_percent") if field in kwargs}
+            kwargs["effective_price"] = effective_price_expression(**prices)
+        updated = super().update(**kwargs)
+        if updated:
+            # update() skips the post_save signal that normally does this.
+            from .utils.helper_functions import bump_catalog_version
+            transaction.on_commit(bump_catalog_version)
+        return updated
 
 class Category(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
-    name = models.CharField(max_length=200, unique=True)
+    name = models.CharField(max_length=200)
     slug = models.SlugField(max_length=50, unique=True, db_index=True, blank=True)
     date = models.DateTimeField(auto_now_add=True)
     is_active = models.BooleanField(default=True) #Better to hide than delete
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(Lower("name"), name="category_name_lower_unique"),
+        ]
+
     def save(self, *args, **kwargs):
         if self.name:
             self.name = self.name.title()
-        if not self.slug:
-            self.slug = self.create_slug_for_category
-        super().save(*args, **kwargs)
+        save_with_slug(self, super().save, *args, **kwargs)
 
     @property
     def create_slug_for_category(self):
-        baseURL = slugify(self.name)
-        slug = baseURL
-        counter = 1
-        while Category.objects.filter(slug=slug).exists():
-            slug = f"{baseURL}-{counter}"
-            counter += 1
-        return slug
+        return next_free_slug(Category, self.name, self.pk)
 
 class Color(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
-    name = models.CharField(max_length=200, unique=True)
+    name = models.CharField(max_length=200)
     date = models.DateField(auto_now_add=True)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(Lower("name"), name="color_name_lower_unique"),
+        ]
+
     def save(self, *args, **kwargs):
         if self.name:
             self.name = self.name.title()
@@ -117,6 +227,23 @@ class Product(models.Model):
     image = models.ImageField(upload_to='images/', blank=True)
     public_id = models.CharField(blank=True)
     srcURL = models.URLField(blank=True)
+    IMAGE_STATUS_CHOICES = [
+        ("none", "None"),
+        ("pending", "Pending"),
+        ("ready", "Ready"),
+        ("failed", "Failed"),
+    ]
+    image_status = models.CharField(max_length=10, choices=IMAGE_STATUS_CHOICES, default="none")
+    # sha256 of the uploaded bytes, products with the same image share one Cloudinary asset.
+    image_hash = models.CharField(max_length=64, blank=True, db_index=True)
+    # Captured from Cloudinary at upload time so reads never call Cloudinary.
+    image_width = models.PositiveIntegerField(null=True, blank=True)
+    image_height = models.PositiveIntegerField(null=True, blank=True)
+    image_format = models.CharField(max_length=10, blank=True)
+    image_version = models.PositiveBigIntegerField(null=True, blank=True)
+    image_checked_at = models.DateTimeField(null=True, blank=True)
+    # Consecutive revalidation runs that could not find the asset on Cloudinary.
+    image_check_failures = models.PositiveIntegerField(default=0)
     name = models.CharField(max_length=200)
     description = models.TextField()
     stock = models.PositiveIntegerField(default=0)
@@ -131,28 +258,43 @@ class Product(models.Model):
         default=0,
         null=True, blank=True
     )
+    # What the customer pays, discount_amount when discounted and original_price otherwise.
+    effective_price = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
     date_added = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = ProductQuerySet.as_manager()
+    # Filled by a Postgres trigger from name (weight A) and description (weight B).
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    class Meta:
+        indexes = [
+            GinIndex(fields=["search_vector"], name="product_search_vector_gin"),
+            # Keyset pagination seeks on these instead of OFFSET.
+            models.Index(fields=["original_price", "id"], name="product_price_id_idx"),
+            models.Index(fields=["name", "id"], name="product_name_id_idx"),
+            # Serves min_price/max_price ranges and the default price ordering.
+            models.Index(fields=["effective_price", "id"], name="product_eff_price_id_idx"),
+            # The storefront only lists products that are in stock.
+            models.Index(fields=["category"], condition=Q(stock__gte=1), name="product_in_stock_category_idx"),
+        ]
+
     def save(self, *args, **kwargs):
+        self.normalize()
+        save_with_slug(self, super().save, *args, **kwargs)
+
+    def normalize(self):
+        # Also called directly by bulk imports, bulk_create never goes through save().
         from .utils.calculation import customer_payout_sale
         if self.name:
             self.name = self.name.title().strip()
         if self.discount_percent != 0:
             self.discount_amount = customer_payout_sale(self.original_price, self.discount_percent)
-        if not self.slug:
-            self.slug = self.create_slug_for_product
-        super().save(*args, **kwargs)
+        self.effective_price = self.discount_amount if self.discount_percent != 0 else self.original_price
 
     @property
     def create_slug_for_product(self):
-        baseURL = slugify(self.name)
-        slug = baseURL
-        counter = 1
-        while Product.objects.filter(slug=slug).exists():
-            slug = f"{baseURL}-{counter}"
-            counter += 1
-        return slug
+        return next_free_slug(Product, self.name, self.pk)
     # What does the default do or mean in the get_or_create?
     
 class BankAccount(models.Model):
@@ -183,6 +325,13 @@ class Cart(models.Model):
    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default="unpaid"
     )
 
+   class Meta:
+        constraints = [
+            # Also the index behind every Cart lookup by customer and status="unpaid".
+            models.UniqueConstraint(fields=["customer"], condition=Q(status="unpaid"),
+                                    name="one_unpaid_cart_per_customer"),
+        ]
+
 class CartItem(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     cart = models.ForeignKey(Cart, on_delete=models.CASCADE, related_name="items")
@@ -190,16 +339,14 @@ class CartItem(models.Model):
     item_quantity = models.PositiveIntegerField(default=1)
     total_amount = models.DecimalField(max_digits=10, decimal_places=2)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=["cart", "product"], name="cartitem_cart_product_idx"),
+        ]
 
     @property
     def cal_total_amount(self):
-        from .utils.calculation import customer_payout_sale
-        if self.product.discount_percent != 0:
-            discount_amount = customer_payout_sale(self.product.original_price, self.product.discount_percent)
-            total_amount = discount_amount * self.item_quantity
-        else:
-            total_amount = self.product.original_price * self.item_quantity
-        return total_amount
+        return self.product.effective_price * self.item_quantity
 
 class Checkout(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
@@ -246,6 +393,7 @@ class Order(models.Model):
 class BlaskListAccessToken(models.Model):
     jti = models.CharField(max_length=255, unique=True)
     blacklisted_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(null=True, blank=True, db_index=True)
 
     def __str__(self):
         return self.jti
\ No newline at end of file
@@ -1,33 +1,91 @@
 from rest_framework import serializers
 from django.core.validators import MinLengthValidator, MaxValueValidator
-from .models import Category, Color, BankAccount
-from .cloudinary import updateImage, uploadImage
+from .models import Category, Color, BankAccount, allocate_slugs
+from .utils.helper_functions import bump_catalog_version
+from .tasks import upload_product_image
+from .utils.images import image_fields, image_format_allowed, IMAGE_ALLOWED_FORMATS
+from django.db import transaction, IntegrityError
 from .payments import getBankCode, createSubAccount
 
+def validate_image_format(value):
+    if not image_format_allowed(value):
+        formats = ", ".join(IMAGE_ALLOWED_FORMATS).lower()
+        raise serializers.ValidationError(f"Only image in these format ({formats}) are allowed.")
+    return value
+
+class BulkNameListSerializer(serializers.ListSerializer):
+    # Bulk creates check every name in one IN query and insert with one bulk_create.
+    model = None
+
+    def to_internal_value(self, data):
+        validated = super().to_internal_value(data)
+        errors, seen = [{} for _ in validated], {}
+        for index, item in enumerate(validated):
+            name = item["name"].lower()
+            if name in seen:
+                errors[index] = {"name": [f"{item['name']} is repeated in this request."]}
+            else:
+                seen[name] = index
+        for name in self.model.objects.filter(name__lower__in=list(seen)).values_list("name", flat=True):
+            index = seen.get(name.lower())
+            if index is not None:
+                errors[index] = {"name": [f"{name} already exist."]}
+        if any(errors):
+            raise serializers.ValidationError(errors)
+        return validated
+
+    def create(self, validated_data):
+        instances = [self.model(**item) for item in validated_data]
+        # bulk_create skips save(), so the title-casing and slugs are done here.
+        for instance in instances:
+            instance.name = instance.name.title()
+        if hasattr(self.model, "slug"):
+            slugs = allocate_slugs(self.model, [instance.name for instance in instances])
+            for instance, slug in zip(instances, slugs):
+                instance.slug = slug
+        try:
+            with transaction.atomic():
+                instances = self.model.objects.bulk_create(instances, batch_size=1000)
+        except IntegrityError:
+            raise serializers.ValidationError({"error": "Some of these names were just created by another request, please try again."})
+        # bulk_create skips the post_save signal that normally does this, after commit for the same reason.
+        transaction.on_commit(bump_catalog_version)
+        return instances
+
+class CategoryListSerializer(BulkNameListSerializer):
+    model = Category
+
+class ColorListSerializer(BulkNameListSerializer):
+    model = Color
+
 class CategorySerializer(serializers.Serializer):
     id = serializers.UUIDField(read_only=True)
     slug = serializers.SlugField(read_only=True)
     name = serializers.CharField(validators=[MinLengthValidator(2)],
                                 max_length=200)
 
+    class Meta:
+        list_serializer_class = CategoryListSerializer
+
     def validate_name(self, value):
-        if Category.objects.filter(name__iexact=value).exists():
+        if isinstance(self.parent, BulkNameListSerializer):
+            return value
+        if Category.objects.filter(name__lower=value.lower()).exists():
             raise serializers.ValidationError(f"Category name: {value} already exist.")
         return value
 
     def create(self, validated_data):
-        # Handle bulk create
-        if isinstance(validated_data, list):
-            categories = [Category(**item) for item in validated_data]
-            return Category.objects.bulk_create(categories)
-        return Category.objects.create(**validated_data)
+        try:
+            return Category.objects.create(**validated_data)
+        except IntegrityError:
+            # Another request created the same name after validate_name ran.
+            raise serializers.ValidationError({"name": f"Category name: {validated_data['name']} already exist."})
 
     def update(self, instance, validated_data):       
         name = validated_data["name"]       
         instance.name = name
-        # saves the name before the slug field.
-        instance.save()
-        instance.slug = instance.create_slug_for_category
+        # A renamed category gets its new slug allocated in the same save.
+        instance.slug = ""
         instance.save()
         return instance
 
@@ -35,17 +93,22 @@ class ColorSerializer(serializers.Serializer):
     id = serializers.UUIDField(read_only=True)
     name = serializers.CharField(validators=[MinLengthValidator(2)],
                                 max_length=200)
+
+    class Meta:
+        list_serializer_class = ColorListSerializer
     
     def validate_name(self, value):
-        if Color.objects.filter(name__iexact=value).exists():
+        if isinstance(self.parent, BulkNameListSerializer):
+            return value
+        if Color.objects.filter(name__lower=value.lower()).exists():
             raise serializers.ValidationError("Color name already exist.")
         return value
 
     def create(self, validated_data):
-        if isinstance(validated_data, list):
-            colors = [Color(**item) for item in validated_data]
-            return Color.objects.bulk_create(colors) 
-        return Color.objects.create(**validated_data)
+        try:
+            return Color.objects.create(**validated_data)
+        except IntegrityError:
+            raise serializers.ValidationError({"name": "Color name already exist."})
     
     def update(self, instance, validated_data):       
         name = validated_data["name"]       
@@ -63,6 +126,12 @@ class ProductSerializer(serializers.Serializer):
     image = serializers.ImageField()
     public_id = serializers.CharField(read_only=True)
     srcURL = serializers.URLField(read_only=True)
+    image_width = serializers.IntegerField(read_only=True)
+    image_height = serializers.IntegerField(read_only=True)
+    image_format = serializers.CharField(read_only=True)
+    image_version = serializers.IntegerField(read_only=True)
+    # "pending" until the background upload fills public_id and srcURL, then "ready" or "failed".
+    image_status = serializers.CharField(read_only=True)
     description = serializers.CharField(validators=[MinLengthValidator(2)],
                                 max_length=255)
     stock = serializers.IntegerField()
@@ -72,8 +141,26 @@ class ProductSerializer(serializers.Serializer):
                         help_text="Discount percentage (0–70).", required=False)
     discount_amount = serializers.DecimalField(max_digits=10, decimal_places=2,
                                                required=False)
+    effective_price = serializers.DecimalField(max_digits=10, decimal_places=2, read_only=True)
     date_added = serializers.DateTimeField(read_only=True)
 
+    def validate_image(self, value):
+        return validate_image_format(value)
+
+class ProductImportSerializer(serializers.Serializer):
+    # One row of a bulk import. Images are given as URLs and uploaded after the insert.
+    category = serializers.UUIDField()
+    name = serializers.CharField(validators=[MinLengthValidator(2)],
+                                max_length=200)
+    description = serializers.CharField(validators=[MinLengthValidator(2)],
+                                max_length=255)
+    stock = serializers.IntegerField(min_value=0)
+    original_price = serializers.DecimalField(max_digits=10, decimal_places=2)
+    discount_percent = serializers.IntegerField(
+                        min_value=0, validators=[MaxValueValidator(70)],
+                        help_text="Discount percentage (0–70).", required=False)
+    image_url = serializers.URLField(required=False)
+
 class ModifyProductSerializer(serializers.Serializer):
     name = serializers.CharField(required=False, validators=[MinLengthValidator(2)],
                                 max_length=200)
@@ -88,6 +175,9 @@ class ModifyProductSerializer(serializers.Serializer):
     discount_amount = serializers.DecimalField(max_digits=10, decimal_places=2,
                                                required=False)
 
+    def validate_image(self, value):
+        return validate_image_format(value)
+
     def update(self, instance, validated_data):
         for field, value in validated_data.items():
             if field == "image":
@@ -96,18 +186,20 @@ class ModifyProductSerializer(serializers.Serializer):
                 setattr(instance, field, value)
 
         image = validated_data.get("image")
-        if image is not None:        
-            srcURL = uploadImage(image)
-            if not isinstance(srcURL, dict):
-                raise serializers.ValidationError("Only image in these format (png. jpeg) are allowed.")                
-            public_id = srcURL['public_id']
-            response = updateImage(public_id)
-            if not isinstance(response, dict):
-                raise serializers.ValidationError("Please try again later")
-            instance.image = image
-            instance.public_id = public_id
-            instance.srcURL = response['secure_url']
+        if image is not None:
+            fields = image_fields(image)
+            if fields["image_hash"] == instance.image_hash and instance.image_status != "failed":
+                # Same bytes as the current image, nothing to store or upload.
+                image = None
+            else:
+                # The current public_id keeps being served until a new upload finishes.
+                instance.image = image
+                for field, value in fields.items():
+                    setattr(instance, field, value)
         instance.save()
+        if image is not None and instance.image_status == "pending":
+            product_id = str(instance.id)
+            transaction.on_commit(lambda: upload_product_image.delay(product_id))
         return instance
 
 class CheckoutSerializer(serializers.Serializer):
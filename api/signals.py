@@ -0,0 +1,22 @@
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.dispatch import receiver
+from django.db import transaction
+from .models import Product, Category, Color
+from .utils.helper_functions import bump_catalog_version
+
+# Any write that can change a catalog page invalidates every cached page in O(1).
+# The bump waits for the commit, otherwise a request in between would cache the old rows
+# under the new version.
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=Color)
+@receiver(post_delete, sender=Color)
+def invalidate_catalog_cache(sender, **kwargs):
+    transaction.on_commit(bump_catalog_version)
+
+@receiver(m2m_changed, sender=Product.color.through)
+def invalidate_catalog_cache_on_colors(sender, action, **kwargs):
+    if action in ["post_add", "post_remove", "post_clear"]:
+        transaction.on_commit(bump_catalog_version)
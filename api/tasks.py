@@ -1,9 +1,14 @@
 from celery import shared_task
 from django.core.mail import EmailMultiAlternatives
 from django.template.loader import render_to_string
-import os
+from django.conf import settings
+from django.utils import timezone
+import os, io, time, logging
 
 host_user = os.environ.get("EMAIL_HOST_USER")
+IMAGE_UPLOAD_RETRIES = int(os.environ.get("IMAGE_UPLOAD_RETRIES", 5))
+IMAGE_UPLOAD_BACKOFF = int(os.environ.get("IMAGE_UPLOAD_BACKOFF", 10))
+logger = logging.getLogger(__name__)
 
 @shared_task
 def send_email(subject, txt_template, html_template, context, email):
@@ -24,3 +29,174 @@ def send_email(subject, txt_template, html_template, context, email):
         msg.send()
     except Exception as e:
         pass
+
+
+def delete_in_chunks(queryset, batch_size):
+    # Small batches keep each DELETE short so logins and blacklist lookups are not blocked.
+    removed = 0
+    while True:
+        ids = list(queryset.values_list("pk", flat=True)[:batch_size])
+        if not ids:
+            return removed
+        deleted, _ = queryset.model.objects.filter(pk__in=ids).delete()
+        removed += deleted
+
+@shared_task
+def prune_expired_tokens(batch_size=None):
+    from rest_framework_simplejwt.token_blacklist.models import OutstandingToken
+    from .models import BlaskListAccessToken
+
+    batch_size = batch_size or int(os.environ.get("TOKEN_PRUNE_BATCH_SIZE", 1000))
+    started, now = time.monotonic(), timezone.now()
+    # Rows written before expires_at existed are kept for the longest token lifetime.
+    legacy_cutoff = now - settings.SIMPLE_JWT["REFRESH_TOKEN_LIFETIME"]
+
+    access_removed = delete_in_chunks(
+        BlaskListAccessToken.objects.filter(expires_at__lte=now), batch_size
+    )
+    access_removed += delete_in_chunks(
+        BlaskListAccessToken.objects.filter(expires_at__isnull=True, blacklisted_at__lte=legacy_cutoff),
+        batch_size
+    )
+    # Deleting an outstanding token cascades to its BlacklistedToken row.
+    outstanding_removed = delete_in_chunks(
+        OutstandingToken.objects.filter(expires_at__lte=now), batch_size
+    )
+
+    report = {
+        "access_tokens_removed": access_removed,
+        "token_blacklist_rows_removed": outstanding_removed,
+        "seconds": round(time.monotonic() - started, 3),
+    }
+    logger.info("Pruned expired tokens: %s", report)
+    return report
+
+
+@shared_task
+def sync_blacklist_cache():
+    from .utils.token import sync_blacklist_cache as sync
+
+    started = time.monotonic()
+    synced = sync()
+    report = {"jtis_cached": synced, "seconds": round(time.monotonic() - started, 3)}
+    if synced is None:
+        logger.info("Blacklist cache sync already running, skipped")
+    else:
+        logger.info("Synced blacklisted jtis to the cache: %s", report)
+    return report
+
+
+@shared_task
+def flush_last_login_buffer():
+    from .utils.last_login import flush_last_login_buffer as flush
+
+    started = time.monotonic()
+    flushed = flush()
+    report = {"users_updated": flushed, "seconds": round(time.monotonic() - started, 3)}
+    if flushed:
+        logger.info("Flushed buffered last logins: %s", report)
+    return report
+
+
+@shared_task
+def revalidate_product_images(batch_size=None, max_misses=None):
+    from django.db.models import F, Case, When, Value
+    from .cloudinary import getImage, imageMetadata
+    from .models import Product
+
+    batch_size = batch_size or int(os.environ.get("IMAGE_REVALIDATE_BATCH_SIZE", 200))
+    max_misses = max_misses or int(os.environ.get("IMAGE_REVALIDATE_MAX_MISSES", 3))
+    # Least recently checked first, so every product comes round over successive runs.
+    products = Product.objects.exclude(public_id="").order_by(
+        F("image_checked_at").asc(nulls_first=True)
+    )[:batch_size]
+    refreshed, failed = 0, 0
+    for product in products:
+        # Older rows were saved with a "product/" prefix that is not part of the Cloudinary id.
+        response = getImage(product.public_id.removeprefix("product/"))
+        if not isinstance(response, dict):
+            failed += 1
+            logger.warning("Could not revalidate image for product %s", product.id)
+            # Checked all the same, so the next run moves on to other products. A single
+            # miss may be Cloudinary being unreachable, only max_misses in a row mark it failed.
+            Product.objects.filter(id=product.id).update(
+                image_checked_at=timezone.now(),
+                image_check_failures=F("image_check_failures") + 1,
+                image_status=Case(
+                    When(image_status="ready", image_check_failures__gte=max_misses - 1, then=Value("failed")),
+                    default=F("image_status"),
+                ),
+            )
+            continue
+        fields = imageMetadata(response)
+        fields["image_checked_at"] = timezone.now()
+        fields["image_check_failures"] = 0
+        # Found again after being marked failed, a pending upload keeps its status.
+        fields["image_status"] = Case(
+            When(image_status="failed", then=Value("ready")), default=F("image_status"),
+        )
+        # Product's update() bumps the catalog version.
+        Product.objects.filter(id=product.id).update(**fields)
+        refreshed += 1
+    return {"refreshed": refreshed, "failed": failed}
+
+
+@shared_task(bind=True, max_retries=IMAGE_UPLOAD_RETRIES)
+def upload_product_image(self, product_id, image=None):
+    from .cloudinary import uploadImage, imageMetadata
+    from .models import Product
+    from .utils.images import find_uploaded_image, preprocess_image
+    from PIL import Image
+
+    products = Product.objects.filter(id=product_id)
+    if image is None:
+        product = products.first()
+        if product is None or not product.image:
+            return False
+        # A newer image replaces the stored file, filtering on its name keeps this
+        # run from overwriting the result of the newer upload.
+        products = products.filter(image=product.image.name)
+        # The same bytes may have finished uploading for another product since this was queued.
+        uploaded = find_uploaded_image(product.image_hash) if product.image_hash else None
+        if uploaded is not None:
+            products.update(image_status="ready", image_checked_at=timezone.now(), **uploaded)
+            return True
+        try:
+            with product.image.open("rb") as file:
+                original = file.read()
+        except OSError:
+            # Storage can be briefly unavailable, it gets the same backoff as a failed upload.
+            logger.warning("Could not read image for product %s", product_id, exc_info=True)
+            original = None
+        if original is None:
+            response = None
+        else:
+            try:
+                processed = preprocess_image(original)
+            except (ValueError, OSError, Image.DecompressionBombError):
+                # Retrying cannot fix an image Pillow refuses to decode.
+                logger.warning("Could not process image for product %s", product_id)
+                products.update(image_status="failed")
+                return False
+            report = {"product": product_id, "original_bytes": len(original), "uploaded_bytes": len(processed),
+                      "bytes_saved": len(original) - len(processed)}
+            logger.info("Preprocessed product image: %s", report)
+            response = uploadImage(io.BytesIO(processed))
+    else:
+        # A URL from a bulk import goes to Cloudinary as is, so it is not preprocessed, hashed
+        # or deduplicated. Fetching vendor supplied URLs from the worker would let an import
+        # make requests into the internal network.
+        response = uploadImage(image)
+
+    if isinstance(response, dict):
+        updated = products.update(
+            public_id=response["public_id"], image_status="ready",
+            image_checked_at=timezone.now(), **imageMetadata(response)
+        )
+    elif self.request.retries < self.max_retries:
+        # IMAGE_UPLOAD_BACKOFF seconds, then doubling on every attempt.
+        raise self.retry(countdown=IMAGE_UPLOAD_BACKOFF * 2 ** self.request.retries)
+    else:
+        logger.warning("Could not upload image for product %s", product_id)
+        updated = products.update(image_status="failed")
+    return isinstance(response, dict) and bool(updated)
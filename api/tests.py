@@ -1,3 +1,669 @@
-from django.test import TestCase
+from django.test import TestCase, SimpleTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.utils import timezone
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import IntegrityError, connection
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from rest_framework_simplejwt.tokens import RefreshToken, AccessToken
+from rest_framework_simplejwt.token_blacklist.models import OutstandingToken
+from .models import auth_user_cache_key, BlaskListAccessToken, CustomUser, Category, Color, Product, Cart, CartItem, next_free_slug, allocate_slugs
+from .serializers import CategorySerializer, ColorSerializer
+from .utils.signing_keys import KeyRegistry, key_registry
+from .utils.token import (encode_token, valid_access_token, sync_blacklist_cache,
+                          BLACKLIST_KEY, BLACKLIST_SYNCED_KEY)
+from .utils.helper_functions import get_catalog_version
+from .utils.product_import import stream_import
+from .utils.facets import compute_facets
+from .utils.last_login import (record_last_login, get_last_login, flush_last_login_buffer,
+                               BUFFER_KEY, FLUSHING_KEY)
+from .tasks import upload_product_image, revalidate_product_images
+from unittest import mock, skipUnless
+from decimal import Decimal
+from datetime import timedelta
+import os, json, base64, tempfile, uuid
 
-# Create your tests here.
+LOCAL_CACHES = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+
+def rsa_private_pem(key=None):
+    key = key or rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    return key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                             serialization.NoEncryption())
+
+def create_user(email="user@example.com", password="Secret-pass-123", **fields):
+    fields = {"first_name": "test", "last_name": "user", "phone_number": "+2348012345678",
+              "email_verified": True, **fields}
+    user = CustomUser(email=email, **fields)
+    user.set_password(password)
+    user.save()
+    return user
+
+def create_product(vendor, category, name, original_price, **fields):
+    fields = {"description": f"About {name}", "stock": 5, **fields}
+    return Product.objects.create(vendor=vendor, category=category, name=name,
+                                  original_price=Decimal(original_price), **fields)
+
+
+@override_settings(CACHES=LOCAL_CACHES)
+class APITestCase(TestCase):
+    """Signs tokens with a throwaway key and keeps the cache in memory."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls._keys_dir = tempfile.TemporaryDirectory()
+        key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        public = key.public_key().public_bytes(serialization.Encoding.PEM,
+                                               serialization.PublicFormat.SubjectPublicKeyInfo)
+        for name, data in (("test.private.pem", rsa_private_pem(key)), ("test.public.pem", public),
+                           ("ACTIVE", b"test")):
+            with open(os.path.join(cls._keys_dir.name, name), "wb") as file:
+                file.write(data)
+        cls._previous_keys_dir = key_registry.keys_dir
+        key_registry.keys_dir = cls._keys_dir.name
+        key_registry._checked_at = None
+
+    @classmethod
+    def tearDownClass(cls):
+        key_registry.keys_dir = cls._previous_keys_dir
+        key_registry._checked_at = None
+        cls._keys_dir.cleanup()
+        super().tearDownClass()
+
+    def setUp(self):
+        cache.clear()
+
+    def authenticate(self, user):
+        access = RefreshToken.for_user(user).access_token
+        self.client.defaults["HTTP_AUTHORIZATION"] = f"Bearer {access}"
+
+
+class KeyRegistryTests(SimpleTestCase):
+    def test_active_rewritten_in_place_is_picked_up(self):
+        with tempfile.TemporaryDirectory() as keys_dir:
+            pem = rsa_private_pem()
+            for kid in ("k1", "k2"):
+                with open(os.path.join(keys_dir, f"{kid}.private.pem"), "wb") as file:
+                    file.write(pem)
+            active = os.path.join(keys_dir, "ACTIVE")
+            with open(active, "w") as file:
+                file.write("k1\n")
+            registry = KeyRegistry(keys_dir, refresh_interval=0)
+            self.assertEqual(registry.active_kid, "k1")
+
+            dir_mtime = os.stat(keys_dir).st_mtime_ns
+            with open(active, "w") as file:
+                file.write("k2\n")
+            # Keep the directory mtime as it was, only the file itself changed.
+            os.utime(active, ns=(dir_mtime + 1, dir_mtime + 1))
+            os.utime(keys_dir, ns=(dir_mtime, dir_mtime))
+            self.assertEqual(registry.active_kid, "k2")
+
+    @mock.patch("api.utils.token.algorithm", "RS256")
+    @mock.patch.dict(os.environ, {"EXPIRY_AT": "10"})
+    def test_tokens_are_not_signed_without_a_private_key(self):
+        with mock.patch.object(key_registry, "signing_key", return_value=("gone", None)):
+            with self.assertRaises(ImproperlyConfigured):
+                encode_token(uuid.uuid4(), "user@example.com", purpose="register")
+            with self.assertRaises(ImproperlyConfigured):
+                str(AccessToken())
+
+
+class LoginQueryCountTests(APITestCase):
+    def login(self):
+        return self.client.post("/api/v1/login/", {"email": "user@example.com",
+                                                   "password": "Secret-pass-123"})
+
+    def test_login_queries_do_not_grow_with_outstanding_tokens(self):
+        user = create_user()
+        RefreshToken.for_user(user)
+        with self.assertNumQueries(6):
+            self.assertEqual(self.login().status_code, 200)
+
+        for _ in range(20):
+            RefreshToken.for_user(user)
+        with self.assertNumQueries(6):
+            self.assertEqual(self.login().status_code, 200)
+        # Only the refresh token handed out by the last login is still live.
+        self.assertEqual(OutstandingToken.objects.filter(user=user, blacklistedtoken__isnull=True).count(), 1)
+
+
+@mock.patch("api.utils.token.algorithm", "RS256")
+@mock.patch.dict(os.environ, {"EXPIRY_AT": "10"})
+class EmailTokenTests(APITestCase):
+    def verify(self, token):
+        return self.client.get("/api/v1/verify_email/register", {"token": token}, HTTP_ACCEPT="application/json")
+
+    def test_token_is_consumed_only_after_the_action_succeeds(self):
+        user = create_user(email_verified=False, is_active=False)
+        token = encode_token(user.id, user.email, purpose="register")
+        # The account lookup fails, the link must stay usable.
+        self.assertEqual(self.verify(token).status_code, 400)
+
+        CustomUser.objects.filter(id=user.id).update(is_active=True)
+        self.assertEqual(self.verify(token).status_code, 200)
+        user.refresh_from_db()
+        self.assertTrue(user.email_verified)
+        self.assertEqual(self.verify(token).status_code, 400)
+
+    def test_second_request_racing_past_decode_is_rejected(self):
+        user = create_user(email_verified=False)
+        token = encode_token(user.id, user.email, purpose="register")
+        # Both requests passed decode_token before either consumed the jti.
+        with mock.patch("api.utils.token.email_token_used", return_value=False):
+            self.assertEqual(self.verify(token).status_code, 200)
+            CustomUser.objects.filter(id=user.id).update(email_verified=False)
+            self.assertEqual(self.verify(token).status_code, 400)
+        user.refresh_from_db()
+        self.assertFalse(user.email_verified)
+
+
+class CatalogVersionTests(APITestCase):
+    def test_version_is_bumped_after_commit(self):
+        version = get_catalog_version()
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            Category.objects.create(name="Shoes")
+            self.assertEqual(get_catalog_version(), version)
+        self.assertEqual(len(callbacks), 1)
+        self.assertNotEqual(get_catalog_version(), version)
+
+    def test_color_writes_bump_the_version(self):
+        color = Color.objects.create(name="Red")
+        for write in (lambda: Color.objects.filter(id=color.id).first().save(), color.delete):
+            version = get_catalog_version()
+            with self.captureOnCommitCallbacks(execute=True):
+                write()
+            self.assertNotEqual(get_catalog_version(), version)
+
+
+class KeysetPaginationTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        vendor = create_user(role="vendor")
+        category = Category.objects.create(name="Shoes")
+        # Three products share a price, the id tie-breaker has to keep them apart.
+        self.products = [create_product(vendor, category, f"Item {index}", price)
+                         for index, price in enumerate(["10.00", "20.00", "20.00", "20.00", "30.00"])]
+        self.authenticate(vendor)
+
+    def walk(self, url, link="next"):
+        pages = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            pages.append([item["id"] for item in response.data["results"]])
+            url = response.data[link]
+        return pages
+
+    def expected(self, descending=False):
+        ordered = sorted(self.products, key=lambda product: (product.effective_price, product.id),
+                         reverse=descending)
+        return [str(product.id) for product in ordered]
+
+    def test_next_links_visit_every_row_once_in_order(self):
+        pages = self.walk("/api/v1/product/?pagination=cursor&page_size=2")
+        self.assertEqual([len(page) for page in pages], [2, 2, 1])
+        self.assertEqual(sum(pages, []), self.expected())
+
+    def test_descending_ordering(self):
+        pages = self.walk("/api/v1/product/?pagination=cursor&page_size=2&ordering=-effective_price")
+        self.assertEqual(sum(pages, []), self.expected(descending=True))
+
+    def test_previous_links_walk_back(self):
+        url = "/api/v1/product/?pagination=cursor&page_size=2"
+        while True:
+            response = self.client.get(url)
+            if not response.data["next"]:
+                break
+            url = response.data["next"]
+        self.assertIsNone(response.data["next"])
+        pages = self.walk(response.data["previous"], link="previous")
+        self.assertEqual(sum(reversed(pages), []), self.expected()[:4])
+
+    def test_first_page_has_no_previous_link(self):
+        response = self.client.get("/api/v1/product/?pagination=cursor&page_size=10")
+        self.assertIsNone(response.data["previous"])
+        self.assertIsNone(response.data["next"])
+        self.assertEqual(len(response.data["results"]), 5)
+
+    def test_invalid_cursor_is_not_found(self):
+        self.assertEqual(self.client.get("/api/v1/product/?cursor=not-a-cursor").status_code, 404)
+
+    def test_tampered_cursor_value_is_not_found(self):
+        for values in (["abc", str(self.products[0].id)], ["10.00", "not-a-uuid"], "10.00"):
+            cursor = base64.urlsafe_b64encode(json.dumps({"v": values, "r": False}).encode()).decode()
+            response = self.client.get(f"/api/v1/product/?cursor={cursor}")
+            self.assertEqual(response.status_code, 404)
+
+
+@override_settings(CACHES=LOCAL_CACHES)
+class SlugTests(TestCase):
+    def setUp(self):
+        self.vendor = create_user(role="vendor")
+        self.category = Category.objects.create(name="Shoes")
+
+    def test_saves_take_the_next_suffix(self):
+        slugs = [create_product(self.vendor, self.category, "Red Shoe", "10.00").slug for _ in range(3)]
+        self.assertEqual(slugs, ["red-shoe", "red-shoe-1", "red-shoe-2"])
+
+    def test_next_free_slug_ignores_other_bases(self):
+        self.assertEqual(next_free_slug(Category, "Boots"), "boots")
+        for name in ["Boots", "Boots Red", "Boots 7"]:
+            Category.objects.create(name=name)
+        # "boots-red" is another base, "boots-7" is a numbered copy of "boots".
+        self.assertEqual(next_free_slug(Category, "boots"), "boots-8")
+
+    def test_next_free_slug_excludes_the_instance_itself(self):
+        category = Category.objects.get(slug="shoes")
+        self.assertEqual(next_free_slug(Category, "Shoes", category.pk), "shoes")
+
+    def test_allocate_slugs_matches_one_by_one_saves(self):
+        self.assertEqual(allocate_slugs(Category, ["Shoes", "Shoes", "Hats"]), ["shoes-1", "shoes-2", "hats"])
+
+    def test_allocate_slugs_avoids_collisions_inside_the_batch(self):
+        # The third base is "shoes-1", which the second name already took.
+        self.assertEqual(allocate_slugs(Category, ["Shoes", "Shoes 1"]), ["shoes-1", "shoes-1-1"])
+        self.assertEqual(allocate_slugs(Category, []), [])
+
+
+@override_settings(CACHES=LOCAL_CACHES)
+class ProductImportTests(TestCase):
+    def setUp(self):
+        self.vendor = create_user(role="vendor")
+        self.category = Category.objects.create(name="Shoes")
+
+    def run_import(self, *rows):
+        lines = ["category,name,description,stock,original_price,discount_percent"]
+        lines += [f"{self.category.id},{name},Leather,3,{price},{percent}" for name, price, percent in rows]
+        upload = SimpleUploadedFile("products.csv", "\n".join(lines).encode(), content_type="text/csv")
+        return [json.loads(line) for line in stream_import(upload, self.vendor)]
+
+    def test_discounted_rows_are_created(self):
+        results = self.run_import(("Boot", "50.00", "10"), ("Sandal", "19.99", ""))
+        self.assertEqual([result["status"] for result in results[:-1]], ["created", "created"])
+        self.assertEqual(results[-1], {"created": 2, "failed": 0})
+        boot = Product.objects.get(name="Boot")
+        self.assertEqual(boot.discount_amount, Decimal("45.00"))
+        self.assertEqual(boot.effective_price, Decimal("45.00"))
+        self.assertEqual(Product.objects.get(name="Sandal").effective_price, Decimal("19.99"))
+
+    def test_failed_bulk_insert_falls_back_to_row_saves(self):
+        with mock.patch.object(Product.objects, "bulk_create", side_effect=IntegrityError):
+            results = self.run_import(("Boot", "50.00", "10"), ("Sandal", "19.99", "0"))
+        self.assertEqual(results[-1], {"created": 2, "failed": 0})
+        self.assertEqual(Product.objects.count(), 2)
+
+    def test_a_row_that_cannot_be_saved_is_reported(self):
+        save = Product.save
+
+        def failing_save(product, *args, **kwargs):
+            if product.name == "Boot":
+                raise IntegrityError("boom")
+            return save(product, *args, **kwargs)
+
+        with mock.patch.object(Product.objects, "bulk_create", side_effect=IntegrityError), \
+                mock.patch.object(Product, "save", failing_save):
+            results = self.run_import(("Boot", "50.00", "10"), ("Sandal", "19.99", "0"))
+        self.assertEqual([result["status"] for result in results[:-1]], ["error", "created"])
+        self.assertEqual(results[-1], {"created": 1, "failed": 1})
+
+    def test_image_urls_are_queued_after_commit_and_uploaded_as_is(self):
+        url = "https://example.com/boot.jpg"
+        upload = SimpleUploadedFile("products.ndjson", json.dumps({
+            "category": str(self.category.id), "name": "Boot", "description": "Leather",
+            "stock": 3, "original_price": "50.00", "image_url": url,
+        }).encode(), content_type="application/x-ndjson")
+        with mock.patch("api.utils.product_import.upload_product_image") as task:
+            with self.captureOnCommitCallbacks() as callbacks:
+                results = [json.loads(line) for line in stream_import(upload, self.vendor)]
+            task.delay.assert_not_called()
+            # The catalog version bump and the upload, both held until the rows are committed.
+            self.assertEqual(len(callbacks), 2)
+            for callback in callbacks:
+                callback()
+        product = Product.objects.get(id=results[0]["id"])
+        task.delay.assert_called_once_with(str(product.id), image=url)
+
+        response = {"public_id": "boot", "secure_url": url, "width": 10, "height": 10, "format": "jpg", "version": 1}
+        with mock.patch("api.cloudinary.uploadImage", return_value=response) as upload_image:
+            self.assertTrue(upload_product_image.apply(args=[str(product.id)], kwargs={"image": url}).get())
+        # Handed to Cloudinary without being fetched, so there is no hash to deduplicate on.
+        upload_image.assert_called_once_with(url)
+        product.refresh_from_db()
+        self.assertEqual((product.image_status, product.image_hash), ("ready", ""))
+
+
+@override_settings(CACHES=LOCAL_CACHES)
+class UploadProductImageTests(TestCase):
+    def test_unreadable_stored_image_is_retried_then_marked_failed(self):
+        product = create_product(create_user(role="vendor"), Category.objects.create(name="Shoes"),
+                                 "Boot", "50.00", image="images/missing.jpg", image_status="pending")
+        with mock.patch("api.cloudinary.uploadImage") as upload:
+            result = upload_product_image.apply(args=[str(product.id)])
+        self.assertFalse(result.get())
+        upload.assert_not_called()
+        product.refresh_from_db()
+        self.assertEqual(product.image_status, "failed")
+
+
+@override_settings(CACHES=LOCAL_CACHES)
+class RevalidateProductImagesTests(TestCase):
+    def setUp(self):
+        self.product = create_product(create_user(role="vendor"), Category.objects.create(name="Shoes"),
+                                      "Boot", "50.00", public_id="product/boot", image_status="ready")
+
+    def revalidate(self, response):
+        with mock.patch("api.cloudinary.getImage", return_value=response):
+            result = revalidate_product_images(max_misses=3)
+        self.product.refresh_from_db()
+        return result
+
+    def test_consecutive_misses_mark_the_image_failed(self):
+        for miss in range(1, 3):
+            self.assertEqual(self.revalidate(False), {"refreshed": 0, "failed": 1})
+            self.assertEqual(self.product.image_check_failures, miss)
+            self.assertIsNotNone(self.product.image_checked_at)
+            self.assertEqual(self.product.image_status, "ready")
+        self.revalidate(False)
+        self.assertEqual(self.product.image_check_failures, 3)
+        self.assertEqual(self.product.image_status, "failed")
+
+    def test_found_again_resets_the_misses(self):
+        for _ in range(3):
+            self.revalidate(False)
+        found = {"secure_url": "https://res.cloudinary.com/x/boot.jpg", "width": 10, "height": 20,
+                 "format": "jpg", "version": 7}
+        self.assertEqual(self.revalidate(found), {"refreshed": 1, "failed": 0})
+        self.assertEqual(self.product.image_check_failures, 0)
+        self.assertEqual(self.product.image_status, "ready")
+        self.assertEqual(self.product.image_width, 10)
+
+    def test_pending_upload_keeps_its_status(self):
+        Product.objects.filter(id=self.product.id).update(image_status="pending")
+        for _ in range(3):
+            self.revalidate(False)
+        self.assertEqual(self.product.image_status, "pending")
+
+
+@skipUnless(connection.vendor == "postgresql", "Query plans are checked on Postgres only.")
+@override_settings(CACHES=LOCAL_CACHES)
+class QueryPlanTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.customer = create_user(email="customer@example.com", phone_number="+2348012345679")
+        vendor = create_user(role="vendor")
+        cls.category = Category.objects.create(name="Shoes")
+        # Mostly out of stock, so the partial index is the smaller one.
+        cls.products = Product.objects.bulk_create([
+            Product(vendor=vendor, category=cls.category, name=f"Item {index}", slug=f"item-{index}",
+                    description="Leather", stock=1 if index < 5 else 0,
+                    original_price=Decimal("10.00"), effective_price=Decimal("10.00"))
+            for index in range(200)
+        ])
+        Cart.objects.bulk_create([Cart(customer=cls.customer, status="paid") for _ in range(50)])
+        cls.cart = Cart.objects.create(customer=cls.customer)
+        CartItem.objects.bulk_create([CartItem(cart=cls.cart, product=product, total_amount=Decimal("10.00"))
+                                      for product in cls.products[:50]])
+
+    def setUp(self):
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE")
+            # Tables this small would be scanned anyway, make the planner show its index choice.
+            cursor.execute("SET LOCAL enable_seqscan = off")
+
+    def assertUsesIndex(self, queryset, index):
+        plan = queryset.explain()
+        self.assertIn(index, plan, plan)
+
+    def test_unpaid_cart_lookup(self):
+        self.assertUsesIndex(Cart.objects.filter(customer=self.customer, status="unpaid"),
+                             "one_unpaid_cart_per_customer")
+
+    def test_cart_item_lookup(self):
+        self.assertUsesIndex(CartItem.objects.filter(cart=self.cart, product=self.products[0]),
+                             "cartitem_cart_product_idx")
+
+    def test_in_stock_category_listing(self):
+        self.assertUsesIndex(Product.objects.filter(category=self.category, stock__gte=1),
+                             "product_in_stock_category_idx")
+
+
+@override_settings(CACHES=LOCAL_CACHES)
+class BulkNameListSerializerTests(TestCase):
+    def test_creates_every_name_with_a_fixed_number_of_queries(self):
+        Category.objects.create(name="Shoes")
+        serializer = CategorySerializer(data=[{"name": "shoes bags"}, {"name": "hats"}, {"name": "shoes-bags"}],
+                                        many=True)
+        with self.assertNumQueries(5):
+            self.assertTrue(serializer.is_valid(), serializer.errors)
+            categories = serializer.save()
+        self.assertEqual([category.name for category in categories], ["Shoes Bags", "Hats", "Shoes-Bags"])
+        self.assertEqual([category.slug for category in categories], ["shoes-bags", "hats", "shoes-bags-1"])
+
+    def test_catalog_version_is_bumped_after_commit(self):
+        for serializer_class in (CategorySerializer, ColorSerializer):
+            version = get_catalog_version()
+            serializer = serializer_class(data=[{"name": "Straw"}, {"name": "Felt"}], many=True)
+            self.assertTrue(serializer.is_valid(), serializer.errors)
+            with self.captureOnCommitCallbacks(execute=True):
+                serializer.save()
+                self.assertEqual(get_catalog_version(), version)
+            self.assertNotEqual(get_catalog_version(), version)
+
+    def test_names_repeated_in_the_request_are_rejected(self):
+        serializer = ColorSerializer(data=[{"name": "Red"}, {"name": "Blue"}, {"name": "RED"}], many=True)
+        self.assertFalse(serializer.is_valid())
+        self.assertEqual(serializer.errors[0], {})
+        self.assertEqual(serializer.errors[1], {})
+        self.assertIn("name", serializer.errors[2])
+        self.assertFalse(Color.objects.exists())
+
+    def test_existing_names_are_rejected_case_insensitively(self):
+        Color.objects.create(name="Red")
+        serializer = ColorSerializer(data=[{"name": "Blue"}, {"name": "red"}], many=True)
+        self.assertFalse(serializer.is_valid())
+        self.assertEqual(serializer.errors[0], {})
+        self.assertEqual(serializer.errors[1], {"name": ["Red already exist."]})
+
+    def test_single_create_still_checks_the_name(self):
+        Color.objects.create(name="Red")
+        serializer = ColorSerializer(data={"name": "RED"})
+        self.assertFalse(serializer.is_valid())
+        self.assertEqual(serializer.errors, {"name": ["Color name already exist."]})
+
+
+@override_settings(CACHES=LOCAL_CACHES)
+class ProductUpdateTests(TestCase):
+    def setUp(self):
+        product = create_product(create_user(role="vendor"), Category.objects.create(name="Shoes"),
+                                 "Boot", "100.00", discount_percent=10)
+        self.products = Product.objects.filter(id=product.id)
+
+    def effective_price(self):
+        return self.products.get().effective_price
+
+    def test_new_discount_reprices(self):
+        self.assertEqual(self.effective_price(), Decimal("90.00"))
+        self.products.update(discount_percent=25)
+        self.assertEqual(self.effective_price(), Decimal("75.00"))
+
+    def test_new_price_keeps_the_stored_discount(self):
+        self.products.update(original_price=Decimal("50.00"))
+        self.assertEqual(self.effective_price(), Decimal("45.00"))
+
+    def test_explicit_none_discount_means_no_discount(self):
+        self.products.update(discount_percent=None)
+        self.assertEqual(self.effective_price(), Decimal("100.00"))
+
+    def test_bulk_update_reprices(self):
+        product = self.products.get()
+        product.original_price, product.discount_percent = Decimal("200.00"), 50
+        Product.objects.bulk_update([product], ["original_price", "discount_percent"])
+        self.assertEqual(self.effective_price(), Decimal("100.00"))
+
+    def test_update_bumps_the_catalog_version_on_commit(self):
+        version = get_catalog_version()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.products.update(stock=0)
+            self.assertEqual(get_catalog_version(), version)
+        self.assertNotEqual(get_catalog_version(), version)
+        self.assertEqual(self.effective_price(), Decimal("90.00"))
+
+
+class FacetTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        vendor = create_user(role="vendor")
+        self.shoes, self.hats = Category.objects.create(name="Shoes"), Category.objects.create(name="Hats")
+        red, blue = Color.objects.create(name="Red"), Color.objects.create(name="Blue")
+        boot = create_product(vendor, self.shoes, "Boot", "1000.00")
+        sandal = create_product(vendor, self.shoes, "Sandal", "6000.00")
+        create_product(vendor, self.shoes, "Loafer", "6000.00")
+        create_product(vendor, self.hats, "Crown", "150000.00")
+        boot.color.add(red, blue)
+        sandal.color.add(red)
+        self.authenticate(vendor)
+
+    def counts(self, facets, facet):
+        return [(value["label"], value["count"]) for value in facets[facet]]
+
+    def test_counts_every_facet_in_one_query(self):
+        with self.assertNumQueries(1):
+            facets = compute_facets(Product.objects.all(), ["category", "color", "price"])
+        self.assertEqual(self.counts(facets, "category"), [("Shoes", 3), ("Hats", 1)])
+        self.assertEqual(self.counts(facets, "color"), [("Red", 2), ("Blue", 1)])
+        self.assertEqual(self.counts(facets, "price"), [("0-5000", 1), ("5000-20000", 2), ("100000+", 1)])
+        self.assertEqual(uuid.UUID(facets["category"][0]["value"]), self.shoes.id)
+
+    def test_list_counts_the_filtered_products(self):
+        response = self.client.get("/api/v1/product/", {"facets": "category,price", "max_price": "10000"})
+        self.assertEqual(response.status_code, 200)
+        facets = response.data["facets"]
+        self.assertEqual(set(facets), {"category", "price"})
+        self.assertEqual(self.counts(facets, "category"), [("Shoes", 3)])
+        self.assertEqual(self.counts(facets, "price"), [("0-5000", 1), ("5000-20000", 2)])
+
+    def test_pages_of_the_same_search_share_the_counts(self):
+        first = self.client.get("/api/v1/product/", {"facets": "all", "page": 1})
+        with CaptureQueriesContext(connection) as queries:
+            second = self.client.get("/api/v1/product/", {"facets": "all", "page": 2})
+        self.assertEqual(first.data["facets"], second.data["facets"])
+        self.assertFalse([query for query in queries if "COUNT(DISTINCT" in query["sql"]])
+
+    def test_no_facets_unless_asked(self):
+        self.assertNotIn("facets", self.client.get("/api/v1/product/").data)
+
+
+class BlacklistCacheTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.access = RefreshToken.for_user(create_user()).access_token
+
+    def test_unsynced_mirror_falls_back_to_one_query(self):
+        with self.assertNumQueries(1):
+            self.assertTrue(valid_access_token(self.access))
+        # The request path never rebuilds the mirror, that is the beat task's job.
+        self.assertIsNone(cache.get(BLACKLIST_SYNCED_KEY))
+        BlaskListAccessToken.objects.create(jti=self.access["jti"])
+        self.assertFalse(valid_access_token(self.access))
+
+    def test_synced_mirror_answers_without_queries(self):
+        BlaskListAccessToken.objects.create(jti=self.access["jti"],
+                                            expires_at=timezone.now() + timedelta(minutes=5))
+        self.assertEqual(sync_blacklist_cache(), 1)
+        with self.assertNumQueries(0):
+            self.assertFalse(valid_access_token(self.access))
+
+    def test_sync_skips_expired_rows(self):
+        BlaskListAccessToken.objects.create(jti="expired", expires_at=timezone.now() - timedelta(minutes=1))
+        BlaskListAccessToken.objects.create(jti="legacy")
+        self.assertEqual(sync_blacklist_cache(), 1)
+        self.assertIsNone(cache.get(BLACKLIST_KEY.format("expired")))
+        self.assertTrue(cache.get(BLACKLIST_KEY.format("legacy")))
+
+
+class CachedJWTAuthenticationTests(APITestCase):
+    def test_snapshot_leaves_out_the_password_hash(self):
+        user = create_user()
+        self.authenticate(user)
+        self.assertEqual(self.client.get("/api/v1/product/").status_code, 200)
+        snapshot = cache.get(auth_user_cache_key(user.id))
+        self.assertEqual(snapshot.email, user.email)
+        self.assertNotIn("password", snapshot.__dict__)
+        # Loaded from the database when a view needs it.
+        self.assertTrue(snapshot.check_password("Secret-pass-123"))
+
+class FakeRedisHashes:
+    """The handful of hash commands the last login buffer uses, with redis-py's bytes replies."""
+    def __init__(self):
+        self.hashes = {}
+
+    def hset(self, key, field, value):
+        self.hashes.setdefault(key, {})[field.encode()] = str(value).encode()
+
+    def hget(self, key, field):
+        return self.hashes.get(key, {}).get(field.encode())
+
+    def hgetall(self, key):
+        return dict(self.hashes.get(key, {}))
+
+    def exists(self, key):
+        return int(key in self.hashes)
+
+    def rename(self, key, new_key):
+        self.hashes[new_key] = self.hashes.pop(key)
+
+    def delete(self, key):
+        self.hashes.pop(key, None)
+
+@override_settings(CACHES=LOCAL_CACHES)
+@mock.patch.dict(os.environ, {"LAST_LOGIN_WRITE_BEHIND": "True"})
+class LastLoginBufferTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.redis = FakeRedisHashes()
+        patcher = mock.patch("api.utils.last_login.get_redis_client", return_value=self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.user = create_user()
+
+    def test_record_read_flush(self):
+        record_last_login(self.user)
+        recorded = self.user.last_login
+        stored = CustomUser.objects.get(id=self.user.id)
+        self.assertIsNone(stored.last_login)
+        self.assertEqual(get_last_login(stored).timestamp(), recorded.timestamp())
+
+        cache.set(auth_user_cache_key(self.user.id), stored)
+        self.assertEqual(flush_last_login_buffer(), 1)
+        stored.refresh_from_db()
+        self.assertEqual(stored.last_login.timestamp(), recorded.timestamp())
+        self.assertEqual(self.redis.hashes, {})
+        self.assertIsNone(cache.get(auth_user_cache_key(self.user.id)))
+        # Nothing buffered any more, the column answers.
+        self.assertEqual(get_last_login(stored), stored.last_login)
+        self.assertEqual(flush_last_login_buffer(), 0)
+
+    def test_read_during_flush_window(self):
+        record_last_login(self.user)
+        recorded = self.user.last_login
+        stored = CustomUser.objects.get(id=self.user.id)
+        # Renamed but not yet written: the timestamp only lives in the flushing hash.
+        self.redis.rename(cache.make_key(BUFFER_KEY), cache.make_key(FLUSHING_KEY))
+        self.assertEqual(get_last_login(stored).timestamp(), recorded.timestamp())
+
+        # A login during the window lands in a fresh buffer and wins over the flushing one.
+        later = self.user.last_login + timedelta(minutes=5)
+        self.redis.hset(cache.make_key(BUFFER_KEY), str(self.user.id), later.timestamp())
+        self.assertEqual(get_last_login(stored).timestamp(), later.timestamp())
+
+        # The leftover flushing hash is finished first, the fresh buffer waits for the next run.
+        self.assertEqual(flush_last_login_buffer(), 1)
+        stored.refresh_from_db()
+        self.assertEqual(stored.last_login.timestamp(), recorded.timestamp())
+        self.assertEqual(get_last_login(stored).timestamp(), later.timestamp())
+        self.assertEqual(flush_last_login_buffer(), 1)
+        stored.refresh_from_db()
+        self.assertEqual(stored.last_login.timestamp(), later.timestamp())
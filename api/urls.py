@@ -3,7 +3,7 @@ from django.urls import path
 
 from .auth_views import CustomerRegView, VendorRegView, LoginView, ResetPasswordView, SetPasswordView, ChangePasswordView, LogoutView, verifyRegEmail, verifyPasswordResetEmail, verifyEmailUpdate, verifyAcctDeactivation, CustomerProfileView, VendorProfileView
 
-from .views import CategoryView, ColorView, ProductView, CartItemView, BankAccountView, confirmBankNameView, PaymentView, VerifyPaymentReference
+from .views import CategoryView, ColorView, ProductView, ProductImportView, CartItemView, BankAccountView, confirmBankNameView, PaymentView, VerifyPaymentReference
 
 from .admin_views import ModifyUserView
 
@@ -51,6 +51,7 @@ urlpatterns = [
 
     # Product
     path('product/', ProductView.as_view({'post': 'create', 'get': 'list'}), name='product'),
+    path('product/import/', ProductImportView.as_view(), name='product_import'),
     path('product/<uuid:id>', ProductView.as_view({'get': 'retrieve', 'put': 'update',
                                                    'patch': 'update', 'delete': 'destroy'}), name='product_id'
                                             ),
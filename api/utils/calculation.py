@@ -2,15 +2,17 @@ from django.shortcuts import get_object_or_404
 from django.db import transaction, IntegrityError
 from ..models import Product, Cart, CartItem, Checkout, BankAccount
 from collections import defaultdict
+from decimal import Decimal, ROUND_HALF_UP
 import os
 
 def discount_from_vendor(original_price, discount_percent):
-    discounted_percentage = discount_percent / 100 # e.g 5/100
-    discount_price = float(original_price) * discounted_percentage # 50,000 * 0.05
-    return discount_price # 2,500
+    # Decimal throughout, prices come from DecimalFields and float would lose cents.
+    discounted_percentage = Decimal(discount_percent or 0) / 100 # e.g 5/100
+    discount_price = Decimal(str(original_price)) * discounted_percentage # 50,000 * 0.05
+    return discount_price.quantize(Decimal("0.01"), rounding=ROUND_HALF_UP) # 2,500
 
 def customer_payout_sale(original_price, discount_percent):
-    customer_payout = original_price - discount_from_vendor(original_price, discount_percent) # 50,00 - 2,500
+    customer_payout = Decimal(str(original_price)) - discount_from_vendor(original_price, discount_percent) # 50,00 - 2,500
     return customer_payout 
 
 def platform_payout(original_price):
@@ -20,7 +22,7 @@ def platform_payout(original_price):
 
 def vendor_payout_sale(original_price, discount_percent):
     if discount_percent != 0:
-        vendor_discount = discount_from_vendor(original_price, discount_percent)
+        vendor_discount = float(discount_from_vendor(original_price, discount_percent))
     else:
         vendor_discount = 0
     vendor_price = original_price - vendor_discount # 50,000 - 2,000
@@ -43,10 +45,8 @@ def check_product_quantity(item_quantity, product):
 
 def total_amount_of_cartItems(validated_data, user):
     total_amount, merged = 0, defaultdict(int)
-    if not Cart.objects.filter(customer=user, status="unpaid").exists():
-        cart = Cart.objects.create(customer=user)
-    else:
-        cart = Cart.objects.get(customer=user, status="unpaid")
+    # get_or_create re-reads the cart when a concurrent request wins the unique constraint.
+    cart, created = Cart.objects.get_or_create(customer=user, status="unpaid")
     for data in validated_data:  
         merged[data["product"]] +=  int(data["item_quantity"])   
     merged_copy = merged.copy()
@@ -56,15 +56,11 @@ def total_amount_of_cartItems(validated_data, user):
         product = get_object_or_404(Product, id=str(product_id), category__is_active=True)
         if not check_product_quantity(total_quantity, product):
             return False
-        item_amount = total_quantity * (
-            product.discount_amount if product.discount_percent != 0 else product.original_price
-        )
+        item_amount = total_quantity * product.effective_price
         cart_item, created = CartItem.objects.get_or_create(cart=cart, product_id=product_id,
                                             defaults={"item_quantity": 0, "total_amount": 0.00})
         cart_item.item_quantity += total_quantity
-        cart_item.total_amount = cart_item.item_quantity * (
-            product.discount_amount if product.discount_percent != 0 else product.original_price
-        )
+        cart_item.total_amount = cart_item.item_quantity * product.effective_price
         cart_item.save(update_fields=["item_quantity", "total_amount"])
         total_amount += item_amount
     return total_amount
@@ -77,17 +73,13 @@ def amount_of_cartItem(validated_data, user):
     product = get_object_or_404(Product, id=str(product_id), category__is_active=True)
     if not check_product_quantity(item_quantity, product):
         return False
-    item_amount = item_quantity * (
-        product.discount_amount if product.discount_percent != 0 else product.original_price
-    )
+    item_amount = item_quantity * product.effective_price
     cart_item, created = CartItem.objects.get_or_create(
                                 cart=cart, product_id=product_id, 
                                 defaults={"item_quantity": 0, "total_amount": 0.00}
                         )
     cart_item.item_quantity += item_quantity
-    cart_item.total_amount = cart_item.item_quantity * (
-            product.discount_amount if product.discount_percent != 0 else product.original_price
-    )
+    cart_item.total_amount = cart_item.item_quantity * product.effective_price
     cart_item.save()
     total_amount += item_amount
     return total_amount
@@ -96,15 +88,11 @@ def update_product_in_cart(product_id, total_quantity, cart):
     total_amount = 0
     # category has been checked to be active in the caller function   
     product = Product.objects.get(id=str(product_id))
-    item_amount = total_quantity * (
-        product.discount_amount if product.discount_percent != 0 else product.original_price
-    )
+    item_amount = total_quantity * product.effective_price
     cart_item, created = CartItem.objects.get_or_create(cart=cart, product_id=product_id,
                                     defaults={"item_quantity": 0, "total_amount": 0.00})
     cart_item.item_quantity = total_quantity
-    cart_item.total_amount = total_quantity * (
-        product.discount_amount if product.discount_percent != 0 else product.original_price
-    )
+    cart_item.total_amount = total_quantity * product.effective_price
     cart_item.save(update_fields=["item_quantity", "total_amount"])
     total_amount += item_amount
     return cart_item
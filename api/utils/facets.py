@@ -0,0 +1,61 @@
+from django.db.models import Count, F, Value, Case, When, CharField
+from django.db.models.functions import Cast
+import os
+
+# ?facets=category,color,price (or ?facets=all) adds counts for the filtered products
+# next to the product page. Price buckets split at PRICE_FACET_BUCKETS.
+FACET_NAMES = ["category", "color", "price"]
+PRICE_FACET_BUCKETS = [int(value) for value in os.environ.get("PRICE_FACET_BUCKETS", "5000,20000,50000,100000").split(",")]
+# Parameters that change the page but not the set of products being counted.
+PAGE_PARAMS = ("page", "page_size", "ordering", "cursor", "pagination")
+
+def requested_facets(request):
+    requested = [name.strip() for name in request.query_params.get("facets", "").lower().split(",")]
+    if "all" in requested or "true" in requested:
+        return FACET_NAMES
+    return [name for name in FACET_NAMES if name in requested]
+
+def price_buckets():
+    labels, lower = [], 0
+    for upper in PRICE_FACET_BUCKETS:
+        labels.append((upper, f"{lower}-{upper}"))
+        lower = upper
+    return labels, f"{lower}+"
+
+def price_bucket_expression():
+    labels, last = price_buckets()
+    # Case takes the first matching When, so ascending upper bounds give the right bucket.
+    whens = [When(effective_price__lt=upper, then=Value(label)) for upper, label in labels]
+    return Case(*whens, default=Value(last), output_field=CharField())
+
+def facet_query(queryset, facet):
+    if facet == "category":
+        key, label = Cast("category_id", CharField()), F("category__name")
+    elif facet == "color":
+        key, label = Cast("color__id", CharField()), F("color__name")
+    else:
+        key = label = price_bucket_expression()
+    return (queryset.order_by()
+            .annotate(facet=Value(facet, output_field=CharField()), key=key, label=label)
+            .values("facet", "key", "label")
+            .annotate(count=Count("id", distinct=True)))
+
+def compute_facets(queryset, facets):
+    """Counts every requested facet over queryset in a single UNION ALL query."""
+    parts = [facet_query(queryset, facet) for facet in facets]
+    rows = parts[0].union(*parts[1:], all=True) if len(parts) > 1 else parts[0]
+    result = {facet: [] for facet in facets}
+    for row in rows:
+        # Products without a category or colour are left out of those facets.
+        if row["key"] is None:
+            continue
+        result[row["facet"]].append({"value": row["key"], "label": row["label"], "count": row["count"]})
+
+    labels, last = price_buckets()
+    bucket_order = {label: index for index, label in enumerate([label for _, label in labels] + [last])}
+    for facet, values in result.items():
+        if facet == "price":
+            values.sort(key=lambda value: bucket_order[value["value"]])
+        else:
+            values.sort(key=lambda value: (-value["count"], value["label"] or ""))
+    return result
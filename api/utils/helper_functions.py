@@ -1,6 +1,8 @@
 from django.utils import timezone
 from collections import defaultdict
 from django.core.cache import cache
+from urllib.parse import urlencode
+import hashlib, time
 
 from datetime import timedelta
 from ..models import (
@@ -234,3 +236,36 @@ def get_client_ip(request):
     else:
         ip_address = request.META['REMOTE_ADDR']
     return ip_address
+
+
+def get_redis_client(key=None):
+    # Raw redis-py client behind the default cache, None when the cache is not Redis.
+    backend = getattr(cache, "_cache", None)
+    if backend is None or not hasattr(backend, "get_client"):
+        return None
+    return backend.get_client(key, write=True)
+
+# Every catalog write bumps the version, which orphans all cached catalog pages at once.
+CATALOG_VERSION_KEY = "catalog_version"
+
+def get_catalog_version():
+    version = cache.get(CATALOG_VERSION_KEY)
+    if version is None:
+        # Seeded from the clock so an evicted counter never restarts at an old version.
+        cache.add(CATALOG_VERSION_KEY, int(time.time()), timeout=None)
+        version = cache.get(CATALOG_VERSION_KEY)
+    return version
+
+def bump_catalog_version():
+    try:
+        cache.incr(CATALOG_VERSION_KEY)
+    except ValueError:
+        cache.add(CATALOG_VERSION_KEY, int(time.time()), timeout=None)
+
+def catalog_cache_key(name, request, ignore=()):
+    # Same filters in a different order must hit the same entry.
+    params = sorted((key, value) for key, values in request.query_params.lists()
+                    for value in values if key not in ignore)
+    raw = f"{request.scheme}://{request.get_host()}{request.path}?{urlencode(params)}"
+    digest = hashlib.md5(raw.encode()).hexdigest()
+    return f"catalog_{name}_v{get_catalog_version()}_{digest}"
\ No newline at end of file
@@ -0,0 +1,58 @@
+from django.utils import timezone
+from PIL import Image, ImageOps
+from ..models import Product
+import hashlib, io, os
+
+# Cloudinary fields copied between products whose images have the same bytes.
+UPLOADED_IMAGE_FIELDS = ["public_id", "srcURL", "image_width", "image_height", "image_format", "image_version"]
+
+# Images are shrunk to fit IMAGE_MAX_DIMENSION and re-encoded before upload.
+IMAGE_MAX_DIMENSION = int(os.environ.get("IMAGE_MAX_DIMENSION", 2048))
+IMAGE_QUALITY = int(os.environ.get("IMAGE_QUALITY", 85))
+IMAGE_ALLOWED_FORMATS = [name.strip().upper() for name in os.environ.get("IMAGE_ALLOWED_FORMATS", "JPEG,PNG,WEBP").split(",")]
+ENCODER_OPTIONS = {
+    "JPEG": {"quality": IMAGE_QUALITY, "optimize": True, "progressive": True},
+    "PNG": {"optimize": True},
+    "WEBP": {"quality": IMAGE_QUALITY, "method": 4},
+}
+
+def image_format_allowed(image):
+    # Django's ImageField leaves the opened Pillow image on the upload, only the header was read.
+    opened = getattr(image, "image", None)
+    return opened is None or opened.format in IMAGE_ALLOWED_FORMATS
+
+def preprocess_image(data):
+    """Returns data re-encoded without metadata and fitted to IMAGE_MAX_DIMENSION."""
+    with Image.open(io.BytesIO(data)) as original:
+        image_format = original.format
+        if image_format not in IMAGE_ALLOWED_FORMATS:
+            raise ValueError(f"Unsupported image format {image_format}.")
+        # Apply the EXIF orientation first, the EXIF block itself is not written back.
+        image = ImageOps.exif_transpose(original)
+        image.thumbnail((IMAGE_MAX_DIMENSION, IMAGE_MAX_DIMENSION))
+        if image_format == "JPEG" and image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+        image.info = {}
+        output = io.BytesIO()
+        image.save(output, format=image_format, **ENCODER_OPTIONS.get(image_format, {}))
+    return output.getvalue()
+
+def image_hash(image):
+    digest = hashlib.sha256()
+    for chunk in image.chunks():
+        digest.update(chunk)
+    image.seek(0)
+    return digest.hexdigest()
+
+def find_uploaded_image(content_hash):
+    """Returns the Cloudinary fields of an asset already uploaded with these bytes, or None."""
+    return (Product.objects.filter(image_hash=content_hash, image_status="ready")
+            .exclude(public_id="").values(*UPLOADED_IMAGE_FIELDS).first())
+
+def image_fields(image):
+    # Identical bytes reuse the existing asset, only new images are queued for upload.
+    content_hash = image_hash(image)
+    uploaded = find_uploaded_image(content_hash)
+    if uploaded is None:
+        return {"image_hash": content_hash, "image_status": "pending"}
+    return {"image_hash": content_hash, "image_status": "ready", "image_checked_at": timezone.now(), **uploaded}
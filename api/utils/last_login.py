@@ -0,0 +1,62 @@
+from django.contrib.auth.models import update_last_login
+from django.core.cache import cache
+from django.utils import timezone
+from datetime import datetime, timezone as dt_timezone
+from ..models import CustomUser, auth_user_cache_key
+from .helper_functions import get_redis_client
+import os
+
+# With LAST_LOGIN_WRITE_BEHIND on, logins only record a timestamp in a Redis hash.
+# flush_last_login_buffer writes the hash to Postgres in one bulk UPDATE every
+# LAST_LOGIN_FLUSH_INTERVAL seconds, so that is how stale last_login can get.
+BUFFER_KEY = "last_login_buffer"
+FLUSHING_KEY = "last_login_buffer_flushing"
+
+def write_behind_enabled():
+    return os.environ.get("LAST_LOGIN_WRITE_BEHIND", "False").lower() in ["true", "1", "yes"]
+
+def record_last_login(user):
+    key = cache.make_key(BUFFER_KEY)
+    client = get_redis_client(key) if write_behind_enabled() else None
+    if client is None:
+        update_last_login(None, user)
+        return
+    now = timezone.now()
+    client.hset(key, str(user.id), now.timestamp())
+    user.last_login = now
+
+def get_last_login(user):
+    """Returns the buffered last login when one is waiting to be flushed."""
+    key = cache.make_key(BUFFER_KEY)
+    client = get_redis_client(key)
+    if client is not None:
+        buffered = client.hget(key, str(user.id))
+        # Between the rename and the bulk UPDATE the timestamp only lives in the flushing hash.
+        if buffered is None:
+            buffered = client.hget(cache.make_key(FLUSHING_KEY), str(user.id))
+        if buffered is not None:
+            return datetime.fromtimestamp(float(buffered), tz=dt_timezone.utc)
+    return user.last_login
+
+def flush_last_login_buffer(batch_size=1000):
+    key, flushing_key = cache.make_key(BUFFER_KEY), cache.make_key(FLUSHING_KEY)
+    client = get_redis_client(key)
+    if client is None:
+        return 0
+    # A leftover flushing hash means the previous run died, finish it before taking more.
+    if not client.exists(flushing_key):
+        if not client.exists(key):
+            return 0
+        client.rename(key, flushing_key)
+
+    buffered = client.hgetall(flushing_key)
+    users = [
+        CustomUser(id=user_id.decode(),
+                   last_login=datetime.fromtimestamp(float(timestamp), tz=dt_timezone.utc))
+        for user_id, timestamp in buffered.items()
+    ]
+    CustomUser.objects.bulk_update(users, ["last_login"], batch_size=batch_size)
+    # bulk_update skips CustomUser.save, which is what normally drops the cached auth snapshot.
+    cache.delete_many([auth_user_cache_key(user.id) for user in users])
+    client.delete(flushing_key)
+    return len(users)
@@ -1,26 +1,31 @@
 from .helper_functions import get_client_ip
-from django.core.cache import cache
+from .rate_limit import get_limiter, get_rate_limits, route_limit
 from django.http import JsonResponse
-import time
+import logging
+
+logger = logging.getLogger(__name__)
 
 class IPTrackingMiddleware:
 
     def __init__(self, get_response):
         self.get_response = get_response
-        self.rate_limit = 60
-        self.window = 300
+        self.limits = get_rate_limits()
+        self.limiter = get_limiter(self.limits)
 
-    def __call__(self, request):
+    def is_allowed(self, request):
         ip_address = get_client_ip(request)
-        now = time.time()
-        address = f"rt_{ip_address}"
-        ip_key = cache.get(address, [])
+        route, scope = route_limit(request.path, self.limits)
+        # The per-user limit is api.custom_classes.UserRateThrottle, it needs the verified token.
+        return self.limiter.hit(f"rt_{scope}_{ip_address}", route["limit"], route["window"])
 
-        requests = [ts for ts in ip_key if now - ts < self.window]
-        if len(requests) >= self.rate_limit:
+    def __call__(self, request):
+        try:
+            allowed = self.is_allowed(request)
+        except Exception:
+            # A throttling outage should not take the API down with it.
+            logger.exception("Rate limiter unavailable")
+            allowed = True
+        if not allowed:
             return JsonResponse({'error': 'Too many requests at a time!'}, status=429)
-        requests.append(now)
-        cache.set(address, requests, self.window)
         response = self.get_response(request)
         return response    
-    
\ No newline at end of file
@@ -0,0 +1,144 @@
+from django.db import transaction, DatabaseError
+from ..models import Product, Category, allocate_slugs
+from ..serializers import ProductImportSerializer
+from ..tasks import upload_product_image
+from .helper_functions import bump_catalog_version
+import csv, io, json, os, logging
+
+logger = logging.getLogger(__name__)
+
+# Rows are read, validated and inserted one batch at a time, so memory use does not
+# grow with the size of the upload. Results go back to the client as NDJSON lines.
+IMPORT_BATCH_SIZE = int(os.environ.get("PRODUCT_IMPORT_BATCH_SIZE", 500))
+NDJSON_TYPES = ["application/x-ndjson", "application/jsonl", "application/json-lines"]
+# A row that fails with one of these is reported and the rest of the file carries on.
+ROW_ERRORS = (DatabaseError, ValueError, TypeError, ArithmeticError)
+ROW_SAVE_ERROR = {"error": "Could not save the product."}
+
+def is_ndjson(upload):
+    name = (upload.name or "").lower()
+    return upload.content_type in NDJSON_TYPES or name.endswith((".ndjson", ".jsonl"))
+
+def read_rows(upload):
+    """Yields (row number, row, error) for every line of a CSV or NDJSON upload."""
+    text = io.TextIOWrapper(upload.file, encoding="utf-8-sig", newline="")
+    if is_ndjson(upload):
+        for number, line in enumerate(text, start=1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError:
+                yield number, None, {"error": "Invalid JSON."}
+                continue
+            if not isinstance(row, dict):
+                yield number, None, {"error": "Each line must be a JSON object."}
+                continue
+            yield number, row, None
+    else:
+        reader = csv.DictReader(text)
+        for row in reader:
+            # Empty cells are treated as missing so optional columns can be left blank.
+            yield reader.line_num, {key: value for key, value in row.items() if value not in ("", None)}, None
+
+def batched(rows, size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def insert_products(rows):
+    """Inserts the (row number, product, image_url) rows, returns the numbers that failed."""
+    try:
+        with transaction.atomic():
+            Product.objects.bulk_create([product for _, product, _ in rows])
+        return set()
+    except DatabaseError:
+        pass
+    # A concurrent writer took one of the slugs or one row is bad, save row by row so
+    # each slug can be retried and a bad row only fails itself.
+    failed = set()
+    for number, product, _ in rows:
+        product.slug = ""
+        try:
+            with transaction.atomic():
+                product.save()
+        except ROW_ERRORS:
+            logger.exception("Import row %s could not be saved", number)
+            failed.add(number)
+    return failed
+
+def import_batch(batch, vendor, categories):
+    results, valid = [], []
+    for number, row, error in batch:
+        if error is not None:
+            results.append({"row": number, "status": "error", "errors": error})
+            continue
+        serializer = ProductImportSerializer(data=row)
+        if not serializer.is_valid():
+            results.append({"row": number, "status": "error", "errors": serializer.errors})
+            continue
+        valid.append((number, serializer.validated_data))
+
+    # Categories are looked up once per batch and remembered for the rest of the file.
+    missing = {str(data["category"]) for _, data in valid} - categories.keys()
+    if missing:
+        categories.update(dict.fromkeys(missing))
+        categories.update({str(category.id): category for category in Category.objects.filter(id__in=missing)})
+
+    rows = []
+    for number, data in valid:
+        category = categories[str(data["category"])]
+        if category is None:
+            results.append({"row": number, "status": "error", "errors": {"category": ["Category does not exist."]}})
+            continue
+        image_url = data.get("image_url")
+        product = Product(
+            category=category, vendor=vendor, name=data["name"], description=data["description"],
+            stock=data["stock"], original_price=data["original_price"],
+            discount_percent=data.get("discount_percent", 0),
+            image_status="pending" if image_url else "none"
+        )
+        try:
+            product.normalize()
+        except ROW_ERRORS:
+            logger.exception("Import row %s could not be prepared", number)
+            results.append({"row": number, "status": "error", "errors": ROW_SAVE_ERROR})
+            continue
+        rows.append((number, product, image_url))
+
+    if rows:
+        products = [product for _, product, _ in rows]
+        for product, slug in zip(products, allocate_slugs(Product, [product.name for product in products])):
+            product.slug = slug
+        failed = insert_products(rows)
+        if len(failed) < len(rows):
+            # bulk_create skips the post_save signal that normally does this.
+            transaction.on_commit(bump_catalog_version)
+        for number, product, image_url in rows:
+            if number in failed:
+                results.append({"row": number, "status": "error", "errors": ROW_SAVE_ERROR})
+                continue
+            if image_url:
+                # Cloudinary fetches the URL itself, see upload_product_image.
+                transaction.on_commit(lambda product_id=str(product.id), image_url=image_url:
+                                      upload_product_image.delay(product_id, image=image_url))
+            results.append({"row": number, "status": "created", "id": str(product.id),
+                            "slug": product.slug, "image_queued": bool(image_url)})
+    return sorted(results, key=lambda result: result["row"])
+
+def stream_import(upload, vendor, batch_size=None):
+    batch_size = batch_size or IMPORT_BATCH_SIZE
+    categories, created, failed = {}, 0, 0
+    for batch in batched(read_rows(upload), batch_size):
+        for result in import_batch(batch, vendor, categories):
+            if result["status"] == "created":
+                created += 1
+            else:
+                failed += 1
+            yield json.dumps(result) + "\n"
+    yield json.dumps({"created": created, "failed": failed}) + "\n"
@@ -0,0 +1,151 @@
+from django.core.cache import cache
+from django.conf import settings
+from .helper_functions import get_redis_client
+from collections import OrderedDict
+import time, uuid, threading
+
+# Trim, count and record in a single round trip. Redis runs the script atomically,
+# so concurrent gunicorn workers can never both take the last free slot.
+# ARGV[4] is the number of hits to record, the local tier syncs several at once.
+SLIDING_WINDOW_SCRIPT = """
+local key = KEYS[1]
+local window = tonumber(ARGV[1])
+local limit = tonumber(ARGV[2])
+local member = ARGV[3]
+local cost = tonumber(ARGV[4])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) * 1000000 + tonumber(clock[2])
+redis.call('ZREMRANGEBYSCORE', key, '-inf', now - window * 1000000)
+local count = redis.call('ZCARD', key)
+local added = math.max(math.min(cost, limit - count), 0)
+for i = 1, added do
+    redis.call('ZADD', key, now, member .. ':' .. i)
+end
+if added > 0 then
+    redis.call('EXPIRE', key, window)
+end
+count = count + added
+local retry_after = 0
+if count >= limit then
+    local oldest = redis.call('ZRANGE', key, 0, 0, 'WITHSCORES')
+    if oldest[2] then
+        retry_after = math.ceil((tonumber(oldest[2]) + window * 1000000 - now) / 1000000)
+    end
+end
+return {added, count, retry_after}
+"""
+
+DEFAULT_RATE_LIMITS = {
+    "mode": "redis",
+    "default": {"limit": 60, "window": 300},
+    "routes": {},
+    "user": None,
+    "local": {"max_entries": 10000, "sync_interval": 5, "sync_ratio": 0.8},
+}
+
+def get_rate_limits():
+    limits = dict(DEFAULT_RATE_LIMITS)
+    limits.update(getattr(settings, "RATE_LIMITS", {}))
+    return limits
+
+def route_limit(path, limits):
+    # Longest configured prefix wins, so "/api/v1/login/" can be stricter than "/api/v1/".
+    matches = [prefix for prefix in limits["routes"] if path.startswith(prefix)]
+    if not matches:
+        return limits["default"], "default"
+    prefix = max(matches, key=len)
+    return limits["routes"][prefix], prefix
+
+class SlidingWindowLimiter:
+
+    def __init__(self):
+        self._script = None
+
+    def _fallback(self, key, limit, window, cost):
+        # Non-Redis caches (local development) keep the old list of timestamps.
+        now = time.time()
+        requests = [ts for ts in cache.get(key, []) if now - ts < window]
+        added = max(min(cost, limit - len(requests)), 0)
+        requests.extend([now] * added)
+        cache.set(key, requests, window)
+        retry_after = 0
+        if len(requests) >= limit:
+            retry_after = int(requests[0] + window - now) + 1
+        return added, len(requests), retry_after
+
+    def record(self, key, limit, window, cost=1):
+        """Records up to cost hits for key and returns (added, count, retry_after)."""
+        redis_key = cache.make_key(key)
+        client = get_redis_client(redis_key)
+        if client is None:
+            return self._fallback(key, limit, window, cost)
+        if self._script is None:
+            self._script = client.register_script(SLIDING_WINDOW_SCRIPT)
+        added, count, retry_after = self._script(
+            keys=[redis_key], args=[window, limit, uuid.uuid4().hex, cost], client=client
+        )
+        return int(added), int(count), int(retry_after)
+
+    def hit(self, key, limit, window):
+        """Records a request for key and returns False when the limit is exceeded."""
+        added, count, retry_after = self.record(key, limit, window)
+        return added == 1
+
+class LocalTierLimiter:
+    """
+    Keeps approximate per-key counters in a bounded LRU inside the worker and only
+    talks to Redis every sync_interval seconds or once a key nears its limit.
+    Keys that Redis reports as over the limit are rejected locally until their
+    window frees up, so abusive clients never reach Redis at all.
+    """
+
+    def __init__(self, remote, max_entries=10000, sync_interval=5, sync_ratio=0.8):
+        self.remote = remote
+        self.max_entries = max_entries
+        self.sync_interval = sync_interval
+        self.sync_ratio = sync_ratio
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _bucket(self, key):
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            # Unsynced hits of an evicted key are dropped, the count is approximate by design.
+            while len(self._buckets) >= self.max_entries:
+                self._buckets.popitem(last=False)
+            bucket = {"remote": 0, "pending": 0, "synced_at": None, "blocked_until": 0}
+            self._buckets[key] = bucket
+        else:
+            self._buckets.move_to_end(key)
+        return bucket
+
+    def hit(self, key, limit, window):
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._bucket(key)
+            if bucket["blocked_until"] > now:
+                return False
+            bucket["pending"] += 1
+            pending = bucket["pending"]
+            estimate = bucket["remote"] + pending
+            stale = bucket["synced_at"] is None or now - bucket["synced_at"] >= self.sync_interval
+            if not stale and estimate < limit * self.sync_ratio:
+                return True
+            bucket["pending"] = 0
+            bucket["synced_at"] = now
+
+        added, count, retry_after = self.remote.record(key, limit, window, cost=pending)
+        with self._lock:
+            bucket["remote"] = count
+            if retry_after:
+                bucket["blocked_until"] = time.monotonic() + retry_after
+        # The current request is the last of the synced hits, it fits only if all of them did.
+        return added == pending
+
+limiter = SlidingWindowLimiter()
+
+def get_limiter(limits):
+    if limits.get("mode") == "local":
+        options = dict(DEFAULT_RATE_LIMITS["local"], **limits.get("local", {}))
+        return LocalTierLimiter(limiter, **options)
+    return limiter
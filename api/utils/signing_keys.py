@@ -0,0 +1,126 @@
+from jwt.algorithms import get_default_algorithms
+import os, time, threading
+
+# Keys placed in SIGNING_KEYS_DIR as "<kid>.private.pem" / "<kid>.public.pem".
+# The kid written in "<SIGNING_KEYS_DIR>/ACTIVE" (or SIGNING_KEY_ID) signs new tokens,
+# every other public key found there keeps verifying tokens already handed out.
+KEYS_DIR = os.environ.get("SIGNING_KEYS_DIR", "keys")
+DEFAULT_KID = "default"
+LEGACY_PRIVATE_KEY = "private_key.pem"
+LEGACY_PUBLIC_KEY = "public_key.pem"
+
+def is_asymmetric(algorithm):
+    return bool(algorithm) and algorithm[:2] in ("RS", "ES", "PS")
+
+class KeyRegistry:
+    def __init__(self, keys_dir=KEYS_DIR, refresh_interval=None):
+        self.keys_dir = keys_dir
+        self.refresh_interval = int(refresh_interval if refresh_interval is not None
+                                    else os.environ.get("SIGNING_KEYS_REFRESH", 60))
+        self._lock = threading.Lock()
+        self._private = {}
+        self._public = {}
+        self._prepared = {}
+        self._active_kid = DEFAULT_KID
+        self._dir_state_seen = None
+        self._checked_at = None
+
+    def _read(self, path):
+        with open(path, "rb") as file:
+            return file.read()
+
+    def _file_state(self, path):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def _dir_state(self):
+        # Rewriting a file in place (echo k2 > keys/ACTIVE) leaves the directory mtime
+        # alone, so the files that are read are compared one by one as well.
+        paths = [LEGACY_PRIVATE_KEY, LEGACY_PUBLIC_KEY]
+        if os.path.isdir(self.keys_dir):
+            paths += [os.path.join(self.keys_dir, name) for name in sorted(os.listdir(self.keys_dir))
+                      if name == "ACTIVE" or name.endswith(".pem")]
+        return self._file_state(self.keys_dir), [(path, self._file_state(path)) for path in paths]
+
+    def _load(self):
+        private, public = {}, {}
+        # Keys from before rotation existed, links already mailed out carry no kid.
+        if os.path.exists(LEGACY_PRIVATE_KEY):
+            private[DEFAULT_KID] = self._read(LEGACY_PRIVATE_KEY)
+        if os.path.exists(LEGACY_PUBLIC_KEY):
+            public[DEFAULT_KID] = self._read(LEGACY_PUBLIC_KEY)
+
+        active_kid = os.environ.get("SIGNING_KEY_ID", DEFAULT_KID)
+        if os.path.isdir(self.keys_dir):
+            for name in os.listdir(self.keys_dir):
+                path = os.path.join(self.keys_dir, name)
+                if name.endswith(".private.pem"):
+                    private[name[:-len(".private.pem")]] = self._read(path)
+                elif name.endswith(".public.pem"):
+                    public[name[:-len(".public.pem")]] = self._read(path)
+            active_file = os.path.join(self.keys_dir, "ACTIVE")
+            if os.path.exists(active_file):
+                active_kid = self._read(active_file).decode().strip() or active_kid
+
+        if active_kid not in private:
+            active_kid = DEFAULT_KID
+        self._private, self._public = private, public
+        self._active_kid = active_kid
+        self._prepared = {}
+
+    def _refresh(self):
+        now = time.monotonic()
+        if self._checked_at is not None and now - self._checked_at < self.refresh_interval:
+            return
+        with self._lock:
+            if self._checked_at is not None and now - self._checked_at < self.refresh_interval:
+                return
+            state = self._dir_state()
+            if self._checked_at is None or state != self._dir_state_seen:
+                self._load()
+                self._dir_state_seen = state
+            self._checked_at = now
+
+    def _prepare(self, kind, kid, raw, algorithm):
+        cache_key = (kind, kid, algorithm)
+        key = self._prepared.get(cache_key)
+        if key is None:
+            key = get_default_algorithms()[algorithm].prepare_key(raw)
+            self._prepared[cache_key] = key
+        return key
+
+    @property
+    def active_kid(self):
+        self._refresh()
+        return self._active_kid
+
+    def private_pem(self, kid=None):
+        self._refresh()
+        return self._private.get(kid or self._active_kid)
+
+    def public_pem(self, kid=None):
+        self._refresh()
+        return self._public.get(kid or self._active_kid)
+
+    def signing_key(self, algorithm):
+        """Returns (kid, parsed private key) used to sign new tokens."""
+        self._refresh()
+        kid = self._active_kid
+        raw = self._private.get(kid)
+        if raw is None:
+            return kid, None
+        return kid, self._prepare("private", kid, raw, algorithm)
+
+    def verifying_key(self, algorithm, kid=None):
+        """Returns the parsed public key for kid, tokens without a kid use the legacy key."""
+        self._refresh()
+        kid = kid or DEFAULT_KID
+        raw = self._public.get(kid)
+        if raw is None:
+            return None
+        return self._prepare("public", kid, raw, algorithm)
+
+key_registry = KeyRegistry()
@@ -1,30 +1,81 @@
 from rest_framework_simplejwt.token_blacklist.models import OutstandingToken, BlacklistedToken
 from rest_framework_simplejwt.tokens import AccessToken
+from django.core.cache import cache
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils import timezone
+from django.db.models import Q
 from api.models import BlaskListAccessToken
-from datetime import datetime, timedelta
-import jwt, os
+from .signing_keys import key_registry
+from datetime import datetime, timedelta, timezone as dt_timezone
+import jwt, os, uuid, hashlib, time
 
 algorithm = os.environ.get("ALGORITHM")
 
-def encode_token(id, email):
+# Email action links (verification, reset, email update, deactivation) can be
+# signed with the RSA key ("rsa") or a much cheaper server-side HMAC ("hmac").
+# Both kinds always verify, so switching backends keeps links in flight working.
+EMAIL_TOKEN_BACKEND = os.environ.get("EMAIL_TOKEN_BACKEND", "rsa")
+HMAC_ALGORITHM = "HS256"
+USED_EMAIL_TOKEN_KEY = "email_token_used_{}"
+
+# Blacklisted jtis are mirrored into the cache so the "not revoked" check
+# never has to reach Postgres. The synced flag tells us the mirror is complete.
+# The sync_blacklist_cache beat task refreshes both every BLACKLIST_SYNC_INTERVAL
+# seconds, requests never rebuild the mirror themselves.
+BLACKLIST_KEY = "blacklist_jti_{}"
+BLACKLIST_SYNCED_KEY = "blacklist_jti_synced"
+BLACKLIST_SYNC_INTERVAL = int(os.environ.get("BLACKLIST_SYNC_INTERVAL", 120))
+BLACKLIST_SYNC_LOCK_KEY = "blacklist_jti_sync_lock"
+BLACKLIST_SYNC_LOCK_TIMEOUT = 60
+
+def email_token_hmac_key():
+    secret = os.environ.get("EMAIL_TOKEN_SECRET") or settings.SECRET_KEY
+    return hashlib.sha256(f"email-action-token:{secret}".encode()).digest()
+
+def encode_token(id, email, purpose=None):
     now = datetime.now()
     expiry_at = now + timedelta(minutes=int(os.environ.get("EXPIRY_AT")))    
     payload = {
         "iss": str(id), "sub": email,
-        "iat": int(now.timestamp()), "exp": int(expiry_at.timestamp())
+        "iat": int(now.timestamp()), "exp": int(expiry_at.timestamp()),
+        "jti": uuid.uuid4().hex
     }
-
-    with open("private_key.pem", "rb") as file:
-        key = file.read()
-    token = jwt.encode(payload, key, algorithm)
+    if purpose:
+        payload["purpose"] = purpose
+    if EMAIL_TOKEN_BACKEND == "hmac":
+        return jwt.encode(payload, email_token_hmac_key(), HMAC_ALGORITHM)
+    kid, key = key_registry.signing_key(algorithm)
+    if key is None:
+        raise ImproperlyConfigured(f"No private key for signing key id {kid!r}.")
+    token = jwt.encode(payload, key, algorithm, headers={"kid": kid})
     return token
 
-def decode_token(token):
-    with open("public_key.pem", "rb") as file:
-        key = file.read()
+def email_token_used(payload):
+    return bool(payload.get("jti")) and cache.get(USED_EMAIL_TOKEN_KEY.format(payload["jti"])) is not None
 
+def consume_email_token(payload):
+    """
+    Marks the token used and returns False when it already was. Views call it after
+    every check has passed, right before the action, and reject the request on False:
+    cache.add is the single-use gate when two requests carry the same link.
+    """
+    if not payload.get("jti"):
+        return True
+    # cache.add only succeeds for the first use of a jti within the token's lifetime.
+    timeout = max(int(payload.get("exp", 0) - time.time()), 1)
+    return cache.add(USED_EMAIL_TOKEN_KEY.format(payload["jti"]), True, timeout)
+
+def decode_token(token, purpose=None):
     try:
-        payload = jwt.decode(token, key, [algorithm])
+        header = jwt.get_unverified_header(token)
+        if header.get("alg") == HMAC_ALGORITHM:
+            key, algorithms = email_token_hmac_key(), [HMAC_ALGORITHM]
+        else:
+            key, algorithms = key_registry.verifying_key(algorithm, header.get("kid")), [algorithm]
+        if key is None:
+            return False
+        payload = jwt.decode(token, key, algorithms)
     except jwt.ExpiredSignatureError:
         return False
     except jwt.InvalidSignatureError:
@@ -37,18 +88,101 @@ def decode_token(token):
         return False
     except jwt.InvalidTokenError:
         return False
+    # Links sent before purpose/jti existed carry neither and keep working until they expire.
+    if purpose and payload.get("purpose", purpose) != purpose:
+        return False
+    # Only checked here, the view consumes the jti once its own checks have passed.
+    if email_token_used(payload):
+        return False
     return payload
 
+def blacklist_synced_timeout():
+    # Two sync intervals, one missed beat run does not send every request to the database.
+    return BLACKLIST_SYNC_INTERVAL * 2
+
+def blacklist_cache_timeout():
+    # Entries have to outlive the synced flag written with them, and a blacklisted access
+    # token has to stay cached for as long as it could still be presented.
+    access_lifetime = int(settings.SIMPLE_JWT["ACCESS_TOKEN_LIFETIME"].total_seconds())
+    return max(access_lifetime, blacklist_synced_timeout())
+
+def cache_blacklisted_jtis(jtis):
+    jtis = [str(jti) for jti in jtis]
+    if jtis:
+        cache.set_many({BLACKLIST_KEY.format(jti): True for jti in jtis},
+                       timeout=blacklist_cache_timeout())
+
+def sync_blacklist_cache():
+    """Rebuilds the cache mirror, returns the number of jtis or None if another run holds the lock."""
+    if not cache.add(BLACKLIST_SYNC_LOCK_KEY, True, timeout=BLACKLIST_SYNC_LOCK_TIMEOUT):
+        return None
+    try:
+        return _sync_blacklist_cache()
+    finally:
+        cache.delete(BLACKLIST_SYNC_LOCK_KEY)
+
+def _sync_blacklist_cache():
+    # Expired rows cannot match a token that still passes signature checks, skip them.
+    live = Q(expires_at__gt=timezone.now()) | Q(expires_at__isnull=True)
+    jtis = BlaskListAccessToken.objects.filter(live).values_list("jti", flat=True).iterator()
+    batch, synced = [], 0
+    for jti in jtis:
+        batch.append(jti)
+        if len(batch) >= 1000:
+            cache_blacklisted_jtis(batch)
+            synced += len(batch)
+            batch = []
+    cache_blacklisted_jtis(batch)
+    synced += len(batch)
+    cache.set(BLACKLIST_SYNCED_KEY, True, timeout=blacklist_synced_timeout())
+    return synced
+
+def blacklist_access_token(jti, exp=None):
+    expires_at = datetime.fromtimestamp(exp, tz=dt_timezone.utc) if exp else None
+    BlaskListAccessToken.objects.create(jti=jti, expires_at=expires_at)
+    cache_blacklisted_jtis([jti])
+
+def get_token_jti(auth_token):
+    """Returns the jti of a validated token (request.auth), or None for anything else."""
+    payload = getattr(auth_token, "payload", None)
+    if isinstance(payload, dict) and payload.get("jti"):
+        return str(payload["jti"])
+    return None
+
 def black_list_user_tokens(user):
-    user_tokens = OutstandingToken.objects.filter(user=user)
-    if user_tokens != []:
-        for token in user_tokens:
-            BlacklistedToken.objects.get_or_create(token=token)
-            BlaskListAccessToken.objects.get_or_create(jti=token)
+    # Only live tokens that are not blacklisted yet, so the cost does not grow with login history.
+    user_tokens = list(
+        OutstandingToken.objects.filter(
+            user=user, blacklistedtoken__isnull=True, expires_at__gt=timezone.now()
+        ).values_list("id", "jti", "expires_at")
+    )
+    if not user_tokens:
+        return
+    BlacklistedToken.objects.bulk_create(
+        [BlacklistedToken(token_id=token_id) for token_id, jti, expires_at in user_tokens],
+        ignore_conflicts=True
+    )
+    BlaskListAccessToken.objects.bulk_create(
+        [BlaskListAccessToken(jti=jti, expires_at=expires_at)
+         for token_id, jti, expires_at in user_tokens],
+        ignore_conflicts=True
+    )
+    cache_blacklisted_jtis([jti for token_id, jti, expires_at in user_tokens])
 
 def valid_access_token(auth_token):
     try:  # parse JWT
-        if not BlaskListAccessToken.objects.filter(jti=auth_token).exists():
+        jti = get_token_jti(auth_token)
+        if jti is None:
+            return False
+        key = BLACKLIST_KEY.format(jti)
+        cached = cache.get_many([BLACKLIST_SYNCED_KEY, key])
+        if not cached.get(BLACKLIST_SYNCED_KEY):
+            # Cache was flushed or the beat task has not run yet, ask the database for this jti.
+            if not BlaskListAccessToken.objects.filter(jti=jti).exists():
+                return True
+            return False
+        if not cached.get(key):
             return True   # token is valid and not blacklisted
+        return False
     except Exception:
         return False      # token missing, invalid, or expired
\ No newline at end of file
@@ -3,11 +3,14 @@ from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
 from rest_framework.decorators import api_view
+from rest_framework.parsers import MultiPartParser
 
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework.filters import SearchFilter, OrderingFilter
 from django.shortcuts import get_object_or_404
 from django.db import transaction
+from django.core.cache import cache
+from django.http import StreamingHttpResponse
 
 from .serializers import (
                             CategorySerializer, ColorSerializer, 
@@ -18,13 +21,16 @@ from .models import (
                         Category, Color, Product, BankAccount, 
                         CartItem, Payment, Cart, Order
                     )
-from .custom_classes import CustomPageNumberPagination
+from .custom_classes import CustomPageNumberPagination, ProductSearchFilter, ProductFilter
 from .utils.helper_functions import (
                                     check_if_admin, 
-                                    request_instance,check_if_list_of_products_exist, check_if_user_cart_is_active, check_if_products_exist_in_cart, update_list_of_cartItems, check_if_product_exist, retrive_cartItems, retrieve_single_cartItem, remove_products_from_cart, remove_a_product_from_cart, check_list_of_products_quantity, deduct_product_quantity_after_payment, check_product_quantity
+                                    request_instance, catalog_cache_key, check_if_list_of_products_exist, check_if_user_cart_is_active, check_if_products_exist_in_cart, update_list_of_cartItems, check_if_product_exist, retrive_cartItems, retrieve_single_cartItem, remove_products_from_cart, remove_a_product_from_cart, check_list_of_products_quantity, deduct_product_quantity_after_payment, check_product_quantity
                                 )
 from .utils.token import valid_access_token
-from .cloudinary import uploadImage, getImage
+from .utils.product_import import stream_import
+from .utils.facets import requested_facets, compute_facets, PAGE_PARAMS
+from .tasks import upload_product_image
+from .utils.images import image_fields
 from .utils.calculation import (
                                     total_amount_of_cartItems, 
                                     amount_of_cartItem, 
@@ -34,6 +40,10 @@ from .utils.calculation import (
 from .payments import (transactionSplit, initializeTransaction, 
                        paymentVerify, initializeTransactionVendors
                     )
+import os
+
+# Catalog pages are also dropped on every catalog write, this only bounds idle entries.
+CATALOG_CACHE_TIMEOUT = int(os.environ.get("CATALOG_CACHE_TIMEOUT", 600))
 
 class CategoryView(ModelViewSet):
     serializer_class = CategorySerializer
@@ -47,6 +57,7 @@ class CategoryView(ModelViewSet):
     search_fields = ["name"]
     pagination_class = CustomPageNumberPagination
     ordering = ["name"]
+    keyset_ordering_fields = ["name"]
 
     def get_queryset(self):
         query = Category.objects.filter(is_active=True)
@@ -71,15 +82,21 @@ class CategoryView(ModelViewSet):
     def list(self, request, *args, **kwargs):
         if not valid_access_token(request.auth):
             return Response({"error": "Invalid Token."}, status=400)
+        cache_key = catalog_cache_key("category_list", request)
+        data = cache.get(cache_key)
+        if data is not None:
+            return Response(data, status=200)
         queryset = self.filter_queryset(self.get_queryset())  # <-- applies filter + search + ordering
 
         page = self.paginate_queryset(queryset)  # <-- applies pagination
         if page is not None:
             serializer = self.get_serializer(page, many=True)
-            return self.get_paginated_response(serializer.data)
-
-        serializer = self.get_serializer(queryset, many=True)
-        return Response({"data": serializer.data}, status=200)
+            response = self.get_paginated_response(serializer.data)
+        else:
+            serializer = self.get_serializer(queryset, many=True)
+            response = Response({"data": serializer.data}, status=200)
+        cache.set(cache_key, response.data, CATALOG_CACHE_TIMEOUT)
+        return response
     
     def retrieve(self, request, *args, **kwargs):
         if not valid_access_token(request.auth):
@@ -242,15 +259,17 @@ class ColorView(ModelViewSet):
 class ProductView(ModelViewSet):
     serializer_class = ProductSerializer
     lookup_field = "id"
+    # Search runs last so its relevance ordering wins when no ?ordering= is given.
     filter_backends = [
                         DjangoFilterBackend, 
-                        SearchFilter,
-                        OrderingFilter
+                        OrderingFilter,
+                        ProductSearchFilter
                     ]
-    fiterset_fields = ["name", "description", "original_price", "discount_amount"]
+    filterset_class = ProductFilter
     search_fields = ["name", "description", "original_price", "discount_amount"]
     pagination_class = CustomPageNumberPagination
-    ordering = ["original_price"]
+    ordering = ["effective_price"]
+    keyset_ordering_fields = ["effective_price", "original_price", "name"]
 
     def get_queryset(self):
         query = Product.objects.filter(stock__gte=1, category__is_active=True)
@@ -265,33 +284,49 @@ class ProductView(ModelViewSet):
         serializer = self.serializer_class(data=request.data, many=request_instance(request))
         serializer.is_valid(raise_exception=True)
         data = serializer.validated_data
-        srcURL = uploadImage(data['image'])
-        if not isinstance(srcURL, dict):
-            return Response({"error": "Only image in these format (png. jpeg) are allowed."}, status=400)
-        
-        public_id = f"product/{srcURL['public_id']}"
         category_id = serializer.validated_data['category']
         category = get_object_or_404(Category, id=str(category_id))
+        # New images are uploaded to Cloudinary by a Celery task, see upload_product_image.
         product = Product.objects.create(
-            category=category, vendor=request.user, image=data['image'],
-            public_id=public_id, srcURL=srcURL['secure_url'],
+            category=category, vendor=request.user, image=data['image'], **image_fields(data['image']),
             name=data['name'], description=data['description'], stock=data['stock'], original_price=data['original_price'], discount_percent=data.get('discount_percent', 0), discount_amount=data.get('discount_amount', 0))
-        product.create_slug_for_product
-        product.save(update_fields=['slug'])    
-        return Response({"success": "Product(s) saved successfully"})
+        product_id = str(product.id)
+        if product.image_status == "pending":
+            transaction.on_commit(lambda: upload_product_image.delay(product_id))
+        return Response({"success": "Product(s) saved successfully", "id": product_id, "image_status": product.image_status})
     
     def list(self, request, *args, **kwargs):
         if not valid_access_token(request.auth):
             return Response({"error": "Invalid Token."}, status=400)
+        cache_key = catalog_cache_key("product_list", request)
+        data = cache.get(cache_key)
+        if data is not None:
+            return Response(data, status=200)
         queryset = self.filter_queryset(self.get_queryset())  # <-- applies filter + search + ordering
 
         page = self.paginate_queryset(queryset)  # <-- applies pagination
         if page is not None:
             serializer = self.get_serializer(page, many=True)
-            return self.get_paginated_response(serializer.data)
+            response = self.get_paginated_response(serializer.data)
+        else:
+            serializer = self.get_serializer(queryset, many=True)
+            response = Response(serializer.data, status=200)
+        facets = requested_facets(request)
+        if facets:
+            if not isinstance(response.data, dict):
+                response.data = {"results": response.data}
+            response.data["facets"] = self.get_facets(request, queryset, facets)
+        cache.set(cache_key, response.data, CATALOG_CACHE_TIMEOUT)
+        return response
 
-        serializer = self.get_serializer(queryset, many=True)
-        return Response(serializer.data, status=200)
+    def get_facets(self, request, queryset, facets):
+        # Cached apart from the page so every page of the same search shares one count.
+        cache_key = catalog_cache_key("product_facets", request, ignore=PAGE_PARAMS)
+        data = cache.get(cache_key)
+        if data is None:
+            data = compute_facets(queryset, facets)
+            cache.set(cache_key, data, CATALOG_CACHE_TIMEOUT)
+        return data
     
     def retrieve(self, request, *args, **kwargs):
         if not valid_access_token(request.auth):
@@ -300,10 +335,6 @@ class ProductView(ModelViewSet):
         if id is None:
             return Response({"error": "Product ID is missing."}, status=400)
         product = get_object_or_404(Product, id=id)
-        public_id = str(product.image).split("/")[-1]
-        response = getImage(public_id)
-        if not isinstance(response, dict):
-            return Response({"error": "Please try again later"}, status=400)
         serializer = self.serializer_class(product)
         return Response(serializer.data, status=200)
     
@@ -333,6 +364,22 @@ class ProductView(ModelViewSet):
         product.delete()
         return Response({"success": "Product has been deleted successfully."}, status=200)
 
+class ProductImportView(APIView):
+    http_method_names = ["post"]
+    parser_classes = [MultiPartParser]
+
+    def post(self, request, *args, **kwargs):
+        if not valid_access_token(request.auth):
+            return Response({"error": "Invalid Token."}, status=400)
+        if request.user.role != "vendor":
+            return Response({"error": "Permission denied, not a vendor account."}, status=400)
+        get_object_or_404(BankAccount, vendor=request.user)
+        upload = request.FILES.get("file")
+        if upload is None:
+            return Response({"error": "Provide a CSV or NDJSON file in the 'file' field."}, status=400)
+        # One NDJSON result per row is written as each batch is inserted, ending with a summary line.
+        return StreamingHttpResponse(stream_import(upload, request.user), content_type="application/x-ndjson")
+
 
 """****************************************CartItem************************************************"""
 class CartItemView(ModelViewSet):
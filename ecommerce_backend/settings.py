@@ -1,4 +1,5 @@
 from pathlib import Path
+from django.core.exceptions import ImproperlyConfigured
 import environ, os
 from datetime import timedelta
 
@@ -25,6 +26,7 @@ INSTALLED_APPS = [
     'django.contrib.messages',
     'cloudinary',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'api',
     
     # Third part apps
@@ -122,7 +124,7 @@ AUTH_USER_MODEL = 'api.CustomUser'
 # Rest framework authentication and permission configurations
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES':[ 
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'api.custom_classes.CachedJWTAuthentication',
     ],
     
     'DEFAULT_PERMISSION_CLASSES': [
@@ -131,14 +133,22 @@ REST_FRAMEWORK = {
     'DEFAULT_FILTER_BACKENDS': [
         'django_filters.rest_framework.DjangoFilterBackend',
     ],
+    'DEFAULT_THROTTLE_CLASSES': [
+        'api.custom_classes.UserRateThrottle',
+    ],
     'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
 }
 
-with open("private_key.pem", "rb") as file:
-    private_key = file.read()
+# Keys are read once per process by the registry and shared with the email tokens.
+from api.utils.signing_keys import key_registry, is_asymmetric
 
-with open("public_key.pem", "rb") as file:
-    public_key = file.read()
+private_key = key_registry.private_pem()
+public_key = key_registry.public_pem()
+if is_asymmetric(env("HASH_KEY")) and private_key is None:
+    raise ImproperlyConfigured(
+        f"{env('HASH_KEY')} needs a private key: add <kid>.private.pem to {key_registry.keys_dir} "
+        f"and write its kid to ACTIVE, or provide private_key.pem."
+    )
 
 # SimpleJWT configuration 
 SIMPLE_JWT = {
@@ -178,6 +188,26 @@ CELERY_TASK_SOFT_TIME_LIMIT = int(env('CELERY_TASK_SOFT_TIME_LIMIT'))
 CELERY_TASK_ACKS_LATE = True
 CELERY_TASK_REJECT_ON_WORKER_LOST = True
 CELERY_BROKER_CONNECTION_RETRY_ON_STARTUP = True
+CELERY_BEAT_SCHEDULE = {
+    "prune-expired-tokens": {
+        "task": "api.tasks.prune_expired_tokens",
+        "schedule": timedelta(minutes=int(env("TOKEN_PRUNE_INTERVAL", default=60))),
+    },
+    # Keeps the cached blacklist mirror complete, requests fall back to the database otherwise.
+    "sync-blacklist-cache": {
+        "task": "api.tasks.sync_blacklist_cache",
+        "schedule": timedelta(seconds=int(env("BLACKLIST_SYNC_INTERVAL", default=120))),
+    },
+    # Only does work when LAST_LOGIN_WRITE_BEHIND is on, the interval is the staleness bound.
+    "flush-last-login-buffer": {
+        "task": "api.tasks.flush_last_login_buffer",
+        "schedule": timedelta(seconds=int(env("LAST_LOGIN_FLUSH_INTERVAL", default=60))),
+    },
+    "revalidate-product-images": {
+        "task": "api.tasks.revalidate_product_images",
+        "schedule": timedelta(minutes=int(env("IMAGE_REVALIDATE_INTERVAL", default=60))),
+    },
+}
 
 # Caching settings
 CACHES = {
@@ -188,6 +218,22 @@ CACHES = {
     }
 }
 
+# Rate limiting (api.utils.middleware.IPTrackingMiddleware)
+# "default" applies per IP, "routes" override it by path prefix and "user" adds a
+# per-account limit on top for authenticated requests, enforced after authentication
+# by api.custom_classes.UserRateThrottle. Windows are in seconds.
+# "mode": "local" counts in-process first and only syncs to Redis every
+# "sync_interval" seconds or once a client reaches "sync_ratio" of its limit.
+RATE_LIMITS = {
+    "mode": env("RATE_LIMIT_MODE", default="redis"),
+    "local": {"max_entries": 10000, "sync_interval": 5, "sync_ratio": 0.8},
+    "default": {"limit": 60, "window": 300},
+    "routes": {
+        "/api/v1/login/": {"limit": 10, "window": 60},
+    },
+    "user": {"limit": 120, "window": 300},
+}
+
 # drf-spectacular settings
 SPECTACULAR_SETTINGS = {
     "TITLE": "Nest API",